@@ -0,0 +1,70 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+_loop = None
+_database_executor = None
+
+
+def get_event_loop():
+    """
+    The event loop of this process. It is kept between spooler tasks so that
+    process-wide resources bound to it (like connection pools) survive.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def run_sync(coro):
+    return get_event_loop().run_until_complete(coro)
+
+
+def get_database_executor():
+    global _database_executor
+    if _database_executor is None:
+        _database_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DATABASE_THREADS,
+                                                thread_name_prefix='database')
+    return _database_executor
+
+
+def _database_call(func, *args, **kwargs):
+    # Threads in the pool live long, so treat every call like a new request
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+async def database_sync(func, *args, **kwargs):
+    """
+    Run blocking database code in a separate thread so the event loop can continue
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_database_executor(),
+                                      functools.partial(_database_call, func, *args, **kwargs))
+
+
+async def gather_dict(coroutines: dict):
+    """
+    Run all the coroutines in the dict concurrently and return a dict with their results. If one of them fails
+    the others are cancelled, so nothing is left running in the background.
+    """
+    keys = list(coroutines.keys())
+    futures = [asyncio.ensure_future(coroutines[key]) for key in keys]
+    try:
+        results = await asyncio.gather(*futures)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+    return dict(zip(keys, results))
@@ -3,7 +3,7 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
-from uwsgi_tasks import task
+from uwsgi_tasks import TaskExecutor, task
 
 try:
     # noinspection PyPackageRequirements
@@ -12,6 +12,6 @@ except ImportError:
     uwsgi = None
 
 
-@task(retry_count=1)
+@task(executor=TaskExecutor.SPOOLER, retry_count=1)
 def do_reload_uwsgi():
     uwsgi.reload()
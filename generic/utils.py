@@ -4,36 +4,12 @@
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
 import os
-import time
 
-from django.db.models import QuerySet
 from django.utils.crypto import get_random_string
 from django.utils.termcolors import colorize
 from requests.auth import AuthBase
 
 
-def retry_get(qs: QuerySet, **kwargs):
-    for delay in (0.5, 1, 2, 4, None):
-        try:
-            return qs.get(**kwargs)
-        except qs.model.DoesNotExist:
-            if delay:
-                time.sleep(delay)
-            else:
-                raise
-
-
-def retry_all(qs: QuerySet):
-    for delay in (0.5, 1, 2, 4, None):
-        result = all(qs.all())
-        if result:
-            return result
-        elif delay:
-            time.sleep(delay)
-        else:
-            return False
-
-
 def print_with_color(msg, **kwargs):
     bold = kwargs.pop('bold', False)
     if bold:
@@ -11,10 +11,11 @@ from instances.models import Marvin, Zaphod
 
 @admin.register(Marvin)
 class MarvinAdmin(admin.ModelAdmin):
-    list_display = ('instance_type', 'name', 'type', 'display_version', 'parallel_tasks_limit',
+    list_display = ('instance_type', 'name', 'type', 'display_version', 'tasks_display', 'score_display',
                     'last_seen_display', 'is_alive')
     list_filter = (AliveFilter, 'instance_type', 'type', VersionFilter)
     search_fields = ('name', 'hostname')
+    readonly_fields = ('effective_tasks_limit', 'timeouts_display', 'score_display', 'tasks_display')
 
 
 @admin.register(Zaphod)
@@ -0,0 +1,11 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from rest_framework.permissions import BasePermission
+
+
+class CanReportHeartbeat(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.has_perm('instances.report_heartbeat'))
@@ -18,5 +18,6 @@ class MarvinSerializer(SerializerExtensionsMixin, HyperlinkedModelSerializer):
                   'type', 'version',
                   'browser_name', 'browser_version',
                   'addresses',
+                  'features',
                   'first_seen', 'last_seen',
                   '_url')
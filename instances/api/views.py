@@ -3,10 +3,22 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
 from instances.api.filters import MarvinFilter
+from instances.api.permissions import CanReportHeartbeat
 from instances.api.serializers import MarvinSerializer
+from instances.heartbeats import check_heartbeats, record_heartbeat
+from instances.info import UNCHANGED, get_marvin_fields, sync_marvin
 from instances.models import Marvin
 
 
@@ -19,7 +31,41 @@ class MarvinViewSet(viewsets.ReadOnlyModelViewSet):
 
     retrieve:
     Retrieve the details of a single Marvin.
+
+    heartbeat:
+    Marvins report their /info here at a short interval. Marvins that stop doing so are marked dead.
     """
     queryset = Marvin.objects.all()
     serializer_class = MarvinSerializer
     filter_class = MarvinFilter
+
+    @action(detail=False, methods=['post'], permission_classes=[CanReportHeartbeat])
+    def heartbeat(self, request, *args, **kwargs):
+        info = request.data
+        try:
+            name = info['name']
+            running = int(info['activity']['browse']['running'])
+            get_marvin_fields(info)
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(_('Invalid Marvin information'))
+
+        marvin = Marvin.objects.filter(name=name).first()
+        change, marvin = sync_marvin(info, marvin.hostname if marvin else self.get_hostname(request), marvin)
+        if change == UNCHANGED:
+            # Only keep last_seen reasonably fresh
+            now = timezone.now()
+            if now - marvin.last_seen > timedelta(seconds=settings.MARVIN_HEARTBEAT_TOUCH):
+                Marvin.objects.filter(pk=marvin.pk).update(last_seen=now)
+
+        record_heartbeat(name, running)
+        check_heartbeats()
+
+        return Response({'interval': settings.MARVIN_HEARTBEAT_INTERVAL})
+
+    @staticmethod
+    def get_hostname(request):
+        address = request.META['REMOTE_ADDR']
+        try:
+            return socket.gethostbyaddr(address)[0]
+        except socket.error:
+            return address
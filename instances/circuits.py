@@ -0,0 +1,82 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Consecutive failures are forgotten this many seconds after the first one
+FAILURES_TIMEOUT = 600
+
+# The probe of a half-open circuit may take this long before another one is allowed
+PROBE_TIMEOUT = 90
+
+
+def get_failures_key(name):
+    return 'marvin_{}_failures'.format(name)
+
+
+def get_open_key(name):
+    return 'marvin_{}_circuit_open'.format(name)
+
+
+def get_probe_key(name):
+    return 'marvin_{}_probe'.format(name)
+
+
+def get_circuit_keys(name):
+    return [get_failures_key(name), get_open_key(name)]
+
+
+def get_circuit_state(values, name):
+    """
+    Determine the state of the circuit of a Marvin from the values of get_circuit_keys
+    """
+    if get_open_key(name) in values:
+        return OPEN
+    elif values.get(get_failures_key(name), 0) >= settings.MARVIN_CIRCUIT_FAILURES:
+        # It has been open long enough, let one request try
+        return HALF_OPEN
+    else:
+        return CLOSED
+
+
+def claim_probe(name):
+    """
+    Only one task at a time gets to find out if a Marvin has recovered. Returns a token for the probe, or None if
+    someone else is already probing.
+    """
+    token = uuid.uuid4().hex
+    return token if cache.add(get_probe_key(name), token, PROBE_TIMEOUT) else None
+
+
+def release_probe(name, token=None):
+    # With a token only that probe is released, a later one of someone else is left alone
+    if token is None or cache.get(get_probe_key(name)) == token:
+        cache.delete(get_probe_key(name))
+
+
+def record_success(name):
+    cache.delete_many([get_failures_key(name), get_open_key(name), get_probe_key(name)])
+
+
+def record_failure(name):
+    key = get_failures_key(name)
+    cache.add(key, 0, FAILURES_TIMEOUT)
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        # Expired in the meantime
+        return
+
+    if failures >= settings.MARVIN_CIRCUIT_FAILURES:
+        # Open the circuit, or open it again if this was a failing probe
+        cache.set(get_open_key(name), True, settings.MARVIN_CIRCUIT_OPEN_TIME)
+        release_probe(name)
@@ -0,0 +1,46 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.conf import settings
+from django.core.cache import cache
+
+from instances.stats import STATS_TIMEOUT
+
+
+def get_limit_key(name):
+    return 'marvin_{}_limit'.format(name)
+
+
+def get_effective_limit(values, marvin):
+    """
+    Determine how many tasks a Marvin should get from the values of a multi-get that includes its limit key
+    """
+    limit = values.get(get_limit_key(marvin.name)) or marvin.effective_tasks_limit or marvin.parallel_tasks_limit
+    return max(1, min(int(limit), marvin.parallel_tasks_limit))
+
+
+def adjust_limit(marvin, success):
+    """
+    Tune the number of tasks a Marvin gets like TCP congestion control: slowly give it more work while /browse keeps
+    working, and halve it when it fails or times out. How long a browse takes depends mostly on the website, so that
+    isn't used as a sign of congestion. The limit the Marvin advertises is never exceeded.
+    """
+    from instances.models import Marvin
+
+    key = get_limit_key(marvin.name)
+    limit = cache.get(key) or float(marvin.effective_tasks_limit or marvin.parallel_tasks_limit)
+
+    if not success:
+        limit = max(1.0, limit * settings.MARVIN_LIMIT_DECREASE)
+    else:
+        # One more task after a full round of good ones
+        limit = min(float(marvin.parallel_tasks_limit), limit + 1 / limit)
+
+    cache.set(key, limit, STATS_TIMEOUT)
+
+    # Only write to the database when it makes a difference
+    if int(limit) != marvin.effective_tasks_limit:
+        marvin.effective_tasks_limit = int(limit)
+        Marvin.objects.filter(pk=marvin.pk).update(effective_tasks_limit=int(limit))
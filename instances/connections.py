@@ -0,0 +1,142 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import asyncio
+import json
+import tempfile
+
+import aiohttp
+from django.conf import settings
+
+from generic.async_utils import database_sync, get_event_loop
+
+# Process-wide connection pools, by Marvin name
+_pools = {}
+
+
+# noinspection PyUnusedLocal
+async def connection_acquired(session, context, params):
+    # Requests are timed from here, waiting for a free connection doesn't count
+    if context.trace_request_ctx is not None:
+        context.trace_request_ctx['connected'] = asyncio.get_event_loop().time()
+
+
+def get_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(connection_acquired)
+    trace_config.on_connection_reuseconn.append(connection_acquired)
+    return trace_config
+
+
+class MarvinResponse:
+    def __init__(self, url, status_code, content=None, path=None):
+        self.url = url
+        self.status_code = status_code
+        self._content = content
+        self.path = path
+
+    @property
+    def content(self):
+        if self.path:
+            with open(self.path, 'rb') as f:
+                return f.read()
+
+        return self._content
+
+    def json(self, **kwargs):
+        return json.loads(self.content.decode('utf-8'), **kwargs)
+
+
+class MarvinConnectionPool:
+    """
+    Keep-alive HTTP connections to a single Marvin, shared by all tasks in this process
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            limit=limit,
+            keepalive_timeout=settings.MARVIN_KEEPALIVE_TIMEOUT,
+        ), trace_configs=[get_trace_config()])
+        self.in_use = 0
+        self.retired = False
+
+    async def post(self, endpoint, data, timeout, spool_dir=None, timing=None):
+        """
+        POST to the Marvin. With a spool_dir the response body is streamed to a file in that directory
+        instead of being kept in memory. With a timing dict the time the request got its connection is stored
+        in it as 'connected'.
+        """
+        self.in_use += 1
+        try:
+            async with self.session.post(url='http://{}:3001/{}'.format(self.name, endpoint),
+                                         json=data,
+                                         timeout=timeout,
+                                         trace_request_ctx=timing) as response:
+                if not spool_dir:
+                    return MarvinResponse(url=str(response.url),
+                                          status_code=response.status,
+                                          content=await response.read())
+
+                with tempfile.NamedTemporaryFile(dir=spool_dir, suffix='.json', delete=False) as f:
+                    async for chunk in response.content.iter_chunked(65536):
+                        f.write(chunk)
+
+                return MarvinResponse(url=str(response.url),
+                                      status_code=response.status,
+                                      path=f.name)
+        finally:
+            self.in_use -= 1
+            if self.retired and not self.in_use:
+                await self.session.close()
+
+    async def retire(self):
+        # Let running requests finish, and close the connections when they are done
+        self.retired = True
+        if not self.in_use:
+            await self.session.close()
+
+
+def get_marvin_pool(marvin):
+    limit = marvin.parallel_tasks_limit * settings.MARVIN_CONNECTIONS_PER_TASK
+    pool = _pools.get(marvin.name)
+    if pool and pool.limit != limit:
+        # The Marvin has changed its limit, start over with a new pool
+        asyncio.ensure_future(pool.retire())
+        pool = None
+
+    if not pool:
+        pool = MarvinConnectionPool(marvin.name, limit)
+        _pools[marvin.name] = pool
+
+    return pool
+
+
+def retire_marvin_pool(name):
+    pool = _pools.pop(name, None)
+    if pool:
+        # This can be called from any thread, the pool belongs to the event loop
+        asyncio.run_coroutine_threadsafe(pool.retire(), get_event_loop())
+
+
+def get_alive_marvin_names():
+    from instances.models import Marvin
+
+    return set(Marvin.objects.filter(is_alive=True).values_list('name', flat=True))
+
+
+async def prune_marvin_pools():
+    """
+    Tear down the pools of Marvins that have been marked dead by another process
+    """
+    if not _pools:
+        return
+
+    alive = await database_sync(get_alive_marvin_names)
+    for name in set(_pools) - alive:
+        pool = _pools.pop(name, None)
+        if pool:
+            await pool.retire()
@@ -0,0 +1,68 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Only one heartbeat per interval checks for Marvins that have gone silent
+CHECK_KEY = 'marvin_heartbeat_check'
+
+# Marvins that haven't sent a heartbeat for this long are left to findmarvins again
+HEARTBEAT_MEMORY = 600
+
+
+def get_heartbeat_key(name):
+    return 'marvin_{}_heartbeat'.format(name)
+
+
+def get_running_key(name):
+    return 'marvin_{}_running'.format(name)
+
+
+def record_heartbeat(name, running):
+    cache.set_many({
+        get_heartbeat_key(name): time.time(),
+        get_running_key(name): running,
+    }, HEARTBEAT_MEMORY)
+
+
+def sends_heartbeats(values, name):
+    return get_heartbeat_key(name) in values
+
+
+def is_silent(values, name):
+    """
+    Determine from the values of a multi-get if a Marvin that sends heartbeats has missed them
+    """
+    last_heartbeat = values.get(get_heartbeat_key(name))
+    return last_heartbeat is not None and time.time() - last_heartbeat > settings.MARVIN_HEARTBEAT_TIMEOUT
+
+
+def get_reported_tasks(values, name):
+    return values.get(get_running_key(name), 0)
+
+
+def mark_silent_marvins_dead():
+    from instances.models import Marvin
+    from instances.registry import invalidate_marvin_registry
+
+    marvins = list(Marvin.objects.filter(is_alive=True))
+    values = cache.get_many([get_heartbeat_key(marvin.name) for marvin in marvins])
+
+    silent = [marvin for marvin in marvins if is_silent(values, marvin.name)]
+    if silent:
+        Marvin.objects.filter(pk__in=[marvin.pk for marvin in silent]).update(is_alive=False)
+        invalidate_marvin_registry()
+
+    return silent
+
+
+def check_heartbeats():
+    if cache.add(CHECK_KEY, True, settings.MARVIN_HEARTBEAT_INTERVAL):
+        return mark_silent_marvins_dead()
+
+    return []
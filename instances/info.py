@@ -0,0 +1,63 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import hashlib
+import json
+
+from django.utils import timezone
+
+from instances.models import Marvin
+
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+
+def get_marvin_fields(info):
+    """
+    Translate what a Marvin reports about itself to our fields
+    """
+    return {
+        'type': info['type'],
+        'version': info['version'],
+        'browser_name': info['browser']['name'],
+        'browser_version': info['browser']['version'],
+        'instance_type': info['instance_type'],
+        'addresses': info['network']['ipv4']['addresses'] + info['network']['ipv6']['addresses'],
+        'features': info.get('features', []),
+        'parallel_tasks_limit': info['limits']['parallel_tasks'],
+    }
+
+
+def get_fingerprint(fields):
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def sync_marvin(info, hostname, marvin=None):
+    """
+    Bring the Marvin up to date with what it reports about itself, only writing what has changed. An unchanged
+    Marvin isn't touched at all, the caller takes care of last_seen. Returns what happened and the Marvin.
+    """
+    fields = get_marvin_fields(info)
+    fields['hostname'] = hostname
+    fingerprint = get_fingerprint(fields)
+
+    if marvin is None:
+        marvin = Marvin.objects.create(name=info['name'], fingerprint=fingerprint,
+                                       last_seen=timezone.now(), is_alive=True, **fields)
+        return NEW, marvin
+
+    if marvin.fingerprint == fingerprint and marvin.is_alive:
+        return UNCHANGED, marvin
+
+    changed = [field for field, value in fields.items() if getattr(marvin, field) != value]
+    for field in changed:
+        setattr(marvin, field, fields[field])
+
+    marvin.fingerprint = fingerprint
+    marvin.last_seen = timezone.now()
+    marvin.is_alive = True
+    marvin.save(update_fields=changed + ['fingerprint', 'last_seen', 'is_alive'])
+    return CHANGED, marvin
@@ -0,0 +1,100 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import os
+import socket
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from generic.async_utils import database_sync
+from instances.circuits import release_probe
+from instances.waitqueue import marvin_wait_queue
+
+
+def get_slot_keys(name, limit):
+    return ['marvin_{}_slot_{}'.format(name, slot) for slot in range(limit)]
+
+
+def count_leases(values, name, limit):
+    return sum(1 for key in get_slot_keys(name, limit) if key in values)
+
+
+class MarvinLease:
+    """
+    A reserved slot on a Marvin. The lease expires by itself, so a crashed process can't keep a slot forever.
+    A lease on a Marvin with a half-open circuit also holds the probe token, which is given up with the slot.
+    """
+
+    def __init__(self, marvin, key, value):
+        self.marvin = marvin
+        self.key = key
+        self.value = value
+        self.released = False
+        self.probe = None
+
+    @classmethod
+    def reserve(cls, marvin, limit=None, lease_time=None):
+        """
+        Claim a free slot on the Marvin, or return None if they are all taken. With a limit below the Marvin's own
+        only the first slots are used.
+        """
+        keys = get_slot_keys(marvin.name, marvin.parallel_tasks_limit)
+        taken = cache.get_many(keys)
+        if limit is not None:
+            if len(taken) >= limit:
+                return None
+            keys = keys[:limit]
+
+        value = {
+            'id': uuid.uuid4().hex,
+            'holder': '{}:{}'.format(socket.gethostname(), os.getpid()),
+            'since': time.time(),
+        }
+        for key in keys:
+            # Adding only succeeds if nobody else holds this slot, which makes it safe between processes
+            if key not in taken and cache.add(key, value, lease_time or settings.MARVIN_LEASE_TIME):
+                return cls(marvin, key, value)
+
+        return None
+
+    def release(self, notify=True):
+        if self.released:
+            return
+
+        # Don't free the slot if our lease expired and someone else has claimed it since
+        if cache.get(self.key) == self.value:
+            cache.delete(self.key)
+
+        # Let another task probe if this one didn't get to it
+        if self.probe:
+            release_probe(self.marvin.name, self.probe)
+
+        self.released = True
+
+        if notify:
+            # Let the next run in line have it
+            marvin_wait_queue.wake(self.marvin.instance_type)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        # Don't block the event loop on the cache
+        await database_sync(self.release)
+
+
+def release_leases(leases, notify=True):
+    for lease in leases:
+        if lease:
+            lease.release(notify=notify)
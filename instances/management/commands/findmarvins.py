@@ -3,75 +3,178 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+import ipaddress
+import queue
 import socket
+import threading
+from concurrent.futures import Future, TimeoutError, as_completed
 
 import requests
+from django.conf import settings
 from django.core.cache import cache
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from instances.heartbeats import get_heartbeat_key, mark_silent_marvins_dead
+from instances.info import CHANGED, NEW, UNCHANGED, sync_marvin
 from instances.models import Marvin
+from instances.registry import invalidate_marvin_registry
+
+
+def normalise_address(address):
+    # Link-local addresses come with a scope
+    return str(ipaddress.ip_address(address.split('%')[0]))
+
+
+def probe_marvin(family, sockaddr):
+    address, port = sockaddr[0:2]
+    hostname = socket.gethostbyaddr(address)[0]
+
+    if family == socket.AF_INET6:
+        address = '[{address}]'.format(address=address)
+    response = requests.get('http://{address}:{port}/info'.format(address=address, port=port),
+                            timeout=settings.FINDMARVINS_PROBE_TIMEOUT).json()
+
+    return hostname, response
+
+
+def run_probes(work):
+    while True:
+        try:
+            future, family, sockaddr = work.get_nowait()
+        except queue.Empty:
+            return
+
+        if not future.set_running_or_notify_cancel():
+            continue
+
+        try:
+            future.set_result(probe_marvin(family, sockaddr))
+        except Exception as e:
+            future.set_exception(e)
+
+
+def start_probes(addresses, workers):
+    """
+    Probe the addresses in daemon threads. A ThreadPoolExecutor's threads are joined when the process exits, so
+    a probe that hangs would keep the command running past its deadline.
+    """
+    work = queue.Queue()
+    probes = {}
+    for family, sockaddr in addresses:
+        future = Future()
+        work.put((future, family, sockaddr))
+        probes[future] = sockaddr
+
+    for count in range(min(workers, len(probes))):
+        threading.Thread(target=run_probes, args=(work,), daemon=True).start()
+
+    return probes
 
 
 class Command(BaseCommand):
     help = 'Scan for marvins'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--deadline', type=float, default=settings.FINDMARVINS_DEADLINE,
+                            help='Stop waiting for Marvins after this many seconds')
+        parser.add_argument('--workers', type=int, default=settings.FINDMARVINS_WORKERS,
+                            help='Number of Marvins to probe at the same time')
+
     def handle(self, *args, **options):
         marvins = set()
+        changes = {NEW: [], CHANGED: [], UNCHANGED: []}
+        known = {marvin.name: marvin for marvin in Marvin.objects.all()}
+
+        # Probe all addresses at the same time, hostname lookups can't time out by themselves so the deadline
+        # covers those as well. Stragglers are left behind when we exit.
+        probes = start_probes([(family, sockaddr)
+                               for family, socktype, proto, canonname, sockaddr
+                               in socket.getaddrinfo('marvin', port=3001, proto=socket.IPPROTO_TCP)],
+                              options['workers'])
+
+        try:
+            for probe in as_completed(probes, timeout=options['deadline']):
+                self.process_probe(probe, probes.pop(probe), marvins, known, changes)
+        except TimeoutError:
+            self.stderr.write(self.style.WARNING(
+                _('Deadline reached, {count} Marvins did not answer in time').format(count=len(probes))
+            ))
+
+        # Unchanged Marvins were seen all the same
+        if changes[UNCHANGED]:
+            Marvin.objects.filter(name__in=changes[UNCHANGED]).update(last_seen=timezone.now())
 
-        for info in socket.getaddrinfo('marvin', port=3001, proto=socket.IPPROTO_TCP):
-            family, socktype, proto, canonname, sockaddr = info
-
-            try:
-                address, port = sockaddr[0:2]
-                hostname = socket.gethostbyaddr(address)[0]
-
-                if family == socket.AF_INET6:
-                    address = '[{address}]'.format(address=address)
-                response = requests.get('http://{address}:{port}/info'.format(address=address, port=port)).json()
-
-                name = response['name']
-                if name in marvins:
-                    # We have already seen this Marvin
-                    continue
-
-                marvin, created = Marvin.objects.update_or_create(defaults={
-                    'hostname': hostname,
-                    'type': response['type'],
-                    'version': response['version'],
-                    'browser_name': response['browser']['name'],
-                    'browser_version': response['browser']['version'],
-                    'instance_type': response['instance_type'],
-                    'addresses': response['network']['ipv4']['addresses'] + response['network']['ipv6']['addresses'],
-                    'parallel_tasks_limit': response['limits']['parallel_tasks'],
-                    'last_seen': timezone.now(),
-                    'is_alive': True,
-                }, name=name)
-
-                marvin_key = 'marvin_{}'.format(marvin.name)
-                cache.set(marvin_key, response['activity']['browse']['running'])
-
-                marvins.add(name)
-
-                if created:
-                    self.stdout.write(self.style.SUCCESS(
-                        'New Marvin {marvin.name} ({marvin.instance_type}) detected'.format(marvin=marvin)
-                    ))
-                else:
-                    self.stdout.write(
-                        'Existing Marvin {marvin.name} ({marvin.instance_type}) updated'.format(marvin=marvin)
-                    )
-            except requests.exceptions.RequestException:
-                self.stderr.write(_('Unable to connect to {address}').format(address=sockaddr))
-            except (KeyError, ValueError):
-                self.stderr.write(_('Marvin {address} returned invalid JSON').format(address=sockaddr))
-
-        # Mark other Marvins as dead
-        for marvin in Marvin.objects.filter(is_alive=True).exclude(name__in=marvins):
-            marvin.is_alive = False
-            marvin.save()
+        # Mark other Marvins as dead, except the ones we didn't get an answer from in time and the ones that send
+        # heartbeats, those are dead when they miss them
+        silent = mark_silent_marvins_dead()
+        for marvin in silent:
+            self.stderr.write(self.style.WARNING(
+                _('Marvin {marvin.name} ({marvin.instance_type}) stopped sending heartbeats').format(marvin=marvin)
+            ))
+
+        unfinished = {normalise_address(sockaddr[0]) for sockaddr in probes.values()}
+        candidates = [marvin for marvin in known.values()
+                      if marvin.is_alive and marvin.name not in marvins and marvin not in silent]
+        heartbeats = cache.get_many([get_heartbeat_key(marvin.name) for marvin in candidates])
 
+        gone = []
+        for marvin in candidates:
+            if get_heartbeat_key(marvin.name) in heartbeats:
+                continue
+
+            if unfinished & {normalise_address(address) for address in marvin.addresses}:
+                self.stderr.write(
+                    _('Marvin {marvin.name} ({marvin.instance_type}) did not answer in time').format(marvin=marvin)
+                )
+                continue
+
+            gone.append(marvin)
             self.stderr.write(self.style.WARNING(
                 _('Marvin {marvin.name} ({marvin.instance_type}) has gone').format(marvin=marvin)
             ))
+
+        if gone:
+            Marvin.objects.filter(pk__in=[marvin.pk for marvin in gone]).update(is_alive=False)
+            invalidate_marvin_registry()
+
+        self.stdout.write(_('{new} new, {changed} changed, {unchanged} unchanged and {gone} gone').format(
+            new=len(changes[NEW]),
+            changed=len(changes[CHANGED]),
+            unchanged=len(changes[UNCHANGED]),
+            gone=len(gone) + len(silent),
+        ))
+
+    def process_probe(self, probe, sockaddr, marvins, known, changes):
+        try:
+            hostname, response = probe.result()
+
+            name = response['name']
+            if name in marvins:
+                # We have already seen this Marvin
+                return
+
+            marvins.add(name)
+
+            if cache.get(get_heartbeat_key(name)):
+                # This Marvin keeps us up to date by itself
+                return
+
+            change, marvin = sync_marvin(response, hostname, known.get(name))
+            changes[change].append(name)
+
+            if change == NEW:
+                self.stdout.write(self.style.SUCCESS(
+                    'New Marvin {marvin.name} ({marvin.instance_type}) detected'.format(marvin=marvin)
+                ))
+            elif change == CHANGED:
+                self.stdout.write(
+                    'Existing Marvin {marvin.name} ({marvin.instance_type}) updated'.format(marvin=marvin)
+                )
+        except requests.exceptions.RequestException:
+            self.stderr.write(_('Unable to connect to {address}').format(address=sockaddr))
+        except socket.error:
+            self.stderr.write(_('Unable to resolve {address}').format(address=sockaddr))
+        except (KeyError, ValueError):
+            self.stderr.write(_('Marvin {address} returned invalid JSON').format(address=sockaddr))
@@ -0,0 +1,29 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from instances.models import Marvin
+
+
+class Command(BaseCommand):
+    help = 'Show the active slot leases of the Marvins'
+
+    def handle(self, *args, **options):
+        now = time.time()
+        for marvin in Marvin.objects.filter(is_alive=True):
+            leases = marvin.get_leases()
+            self.stdout.write('{marvin.name} ({marvin.instance_type}): {count} / {marvin.parallel_tasks_limit}'.format(
+                marvin=marvin,
+                count=len(leases)
+            ))
+
+            for lease in leases:
+                self.stdout.write('  {holder} for {age:.0f} seconds'.format(
+                    holder=lease['holder'],
+                    age=now - lease['since']
+                ))
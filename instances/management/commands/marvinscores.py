@@ -0,0 +1,30 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.core.management.base import BaseCommand
+
+from instances.models import Marvin
+from instances.registry import marvin_registry
+
+
+class Command(BaseCommand):
+    help = 'Show how the scheduler scores the Marvins, best first'
+
+    def handle(self, *args, **options):
+        instance_types = [instance_type for instance_type, label in Marvin._meta.get_field('instance_type').choices]
+        for instance_type, scores in marvin_registry.get_scores(instance_types).items():
+            self.stdout.write(self.style.SUCCESS(instance_type))
+
+            for state in scores:
+                self.stdout.write('  {marvin.name}: score {state.score:.2f}, '
+                                  'tasks {state.tasks} / {state.limit} (max {marvin.parallel_tasks_limit}), '
+                                  'latency {latency}, error rate {error_rate}, circuit {state.circuit}'.format(
+                                      marvin=state.marvin,
+                                      state=state,
+                                      latency='{:.1f}s'.format(state.stats['browse_latency'])
+                                      if 'browse_latency' in state.stats else '-',
+                                      error_rate='{:.0%}'.format(state.stats['error_rate'])
+                                      if 'error_rate' in state.stats else '-',
+                                  ))
@@ -0,0 +1,24 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 18:45
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0004_add_dual_stack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marvin',
+            name='features',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=50), blank=True,
+                                                            default=list, size=None, verbose_name='features'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0005_marvin_features'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marvin',
+            name='effective_tasks_limit',
+            field=models.PositiveIntegerField(blank=True,
+                                              help_text='Tuned automatically, up to the parallel tasks limit',
+                                              null=True, verbose_name='effective tasks limit'),
+        ),
+    ]
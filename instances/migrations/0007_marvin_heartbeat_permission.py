@@ -0,0 +1,22 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:01
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0006_marvin_effective_tasks_limit'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='marvin',
+            options={'ordering': ('-is_alive', 'instance_type', '-last_seen'),
+                     'permissions': (('report_heartbeat', 'Can report Marvin heartbeats'),)},
+        ),
+    ]
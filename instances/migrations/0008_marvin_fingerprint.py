@@ -0,0 +1,22 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0007_marvin_heartbeat_permission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='marvin',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, verbose_name='fingerprint'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0008_marvin_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zaphod',
+            name='bulk_callback_url',
+            field=models.URLField(blank=True, help_text='Deliver updates in batches here instead of one by one',
+                                  verbose_name='bulk callback URL'),
+        ),
+    ]
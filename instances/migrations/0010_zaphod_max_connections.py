@@ -0,0 +1,26 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0009_zaphod_bulk_callback_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zaphod',
+            name='max_connections',
+            field=models.PositiveSmallIntegerField(
+                default=4,
+                help_text='How many updates are delivered at the same time',
+                verbose_name='maximum connections'
+            ),
+        ),
+    ]
@@ -3,6 +3,7 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+from django.conf import settings
 from django.contrib.gis.db import models
 from django.contrib.humanize.templatetags.humanize import naturaltime
 from django.contrib.postgres.fields import ArrayField
@@ -10,6 +11,11 @@ from django.core.cache import cache
 from django.core.validators import RegexValidator, URLValidator
 from django.utils.translation import gettext_lazy as _
 
+from instances.concurrency import get_effective_limit, get_limit_key
+from instances.leases import MarvinLease, get_slot_keys
+from instances.scoring import get_scorer
+from instances.stats import get_stats_key, get_timeout
+
 
 class ZaphodManager(models.Manager):
     def get_by_natural_key(self, name):
@@ -24,6 +30,10 @@ class Zaphod(models.Model):
         RegexValidator(URLValidator.host_re, message=_("Please provide a valid host name"))
     ])
     token = models.CharField(_("token"), max_length=40)
+    bulk_callback_url = models.URLField(_('bulk callback URL'), blank=True,
+                                        help_text=_('Deliver updates in batches here instead of one by one'))
+    max_connections = models.PositiveSmallIntegerField(_('maximum connections'), default=4,
+                                                       help_text=_('How many updates are delivered at the same time'))
 
     class Meta:
         ordering = ('name',)
@@ -60,15 +70,25 @@ class Marvin(models.Model):
         ('nat64', _('IPv6 with NAT64')),
     ])
     addresses = ArrayField(models.GenericIPAddressField(), verbose_name=_('addresses'), default=list)
+    features = ArrayField(models.CharField(max_length=50), verbose_name=_('features'), blank=True, default=list)
 
     first_seen = models.DateTimeField(_('first seen'), auto_now_add=True)
     last_seen = models.DateTimeField(_('last seen'))
 
     is_alive = models.BooleanField(_('is alive'), default=True)
+
+    # Hash of what the Marvin last reported about itself, to quickly see if anything changed
+    fingerprint = models.CharField(_('fingerprint'), max_length=40, blank=True, editable=False)
     parallel_tasks_limit = models.PositiveIntegerField(_('parallel tasks limit'))
+    effective_tasks_limit = models.PositiveIntegerField(_('effective tasks limit'), blank=True, null=True,
+                                                        help_text=_('Tuned automatically, up to the parallel '
+                                                                    'tasks limit'))
 
     class Meta:
         ordering = ('-is_alive', 'instance_type', '-last_seen')
+        permissions = (
+            ('report_heartbeat', _('Can report Marvin heartbeats')),
+        )
 
     def __str__(self):
         return _('{name} ({type}: {is_alive})').format(name=self.name,
@@ -79,26 +99,19 @@ class Marvin(models.Model):
         return self.name
 
     @property
-    def cache_key(self):
-        return 'marvin_{}'.format(self.name)
+    def slot_keys(self):
+        return get_slot_keys(self.name, self.parallel_tasks_limit)
+
+    def get_leases(self):
+        values = cache.get_many(self.slot_keys)
+        return [values[key] for key in self.slot_keys if key in values]
 
     @property
     def tasks(self):
-        return cache.get(self.cache_key, 0)
+        return len(self.get_leases())
 
-    @tasks.setter
-    def tasks(self, value):
-        cache.set(self.cache_key, value)
-
-    def __enter__(self):
-        key = self.cache_key
-        cache.add(key, 0)
-        cache.incr(key)
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        key = self.cache_key
-        cache.add(key, 1)
-        cache.decr(key)
+    def reserve(self, limit=None, lease_time=None):
+        return MarvinLease.reserve(self, limit, lease_time)
 
     def display_version(self):
         return '.'.join(map(str, self.version))
@@ -117,3 +130,21 @@ class Marvin(models.Model):
 
     last_seen_display.short_description = _('last seen')
     last_seen_display.admin_order_field = 'last_seen'
+
+    def tasks_display(self):
+        return '{} / {}'.format(self.tasks, self.effective_tasks_limit or self.parallel_tasks_limit)
+
+    tasks_display.short_description = _('tasks')
+
+    def timeouts_display(self):
+        return ', '.join(['{}: {:.1f}s'.format(endpoint, get_timeout(self.name, endpoint))
+                          for endpoint in sorted(settings.MARVIN_TIMEOUTS)])
+
+    timeouts_display.short_description = _('timeouts')
+
+    def score_display(self):
+        values = cache.get_many([get_stats_key(self.name), get_limit_key(self.name)])
+        return '{:.2f}'.format(get_scorer()(self, self.tasks, get_effective_limit(values, self),
+                                            values.get(get_stats_key(self.name), {})))
+
+    score_display.short_description = _('score')
@@ -0,0 +1,117 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import threading
+import uuid
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from instances.circuits import OPEN, get_circuit_keys, get_circuit_state
+from instances.concurrency import get_effective_limit, get_limit_key
+from instances.heartbeats import get_heartbeat_key, get_reported_tasks, get_running_key, is_silent
+from instances.leases import count_leases
+from instances.scoring import get_scorer
+from instances.stats import get_stats_key
+
+# Changes whenever a Marvin changes, so every process knows when to reload its registry
+GENERATION_KEY = 'marvin_registry_generation'
+
+MarvinState = namedtuple('MarvinState', ['marvin', 'tasks', 'limit', 'stats', 'circuit', 'silent', 'score'])
+
+
+def invalidate_marvin_registry():
+    cache.set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+class MarvinRegistry:
+    """
+    The alive Marvins, cached in this process and indexed by instance type
+    """
+
+    def __init__(self):
+        self.generation = None
+        self.by_type = {}
+        self.lock = threading.Lock()
+
+    def load(self, generation):
+        from instances.models import Marvin
+
+        by_type = {}
+        for marvin in Marvin.objects.filter(is_alive=True):
+            by_type.setdefault(marvin.instance_type, []).append(marvin)
+
+        self.by_type = by_type
+        self.generation = generation
+
+    def get_state(self, instance_types):
+        """
+        Get the current generation, and the leases, statistics and circuits of the Marvins of these instance types,
+        in one round-trip
+        """
+        marvins = [marvin for instance_type in instance_types for marvin in self.by_type.get(instance_type, [])]
+        values = cache.get_many([GENERATION_KEY] +
+                                [key for marvin in marvins for key in marvin.slot_keys] +
+                                [get_stats_key(marvin.name) for marvin in marvins] +
+                                [key for marvin in marvins for key in get_circuit_keys(marvin.name)] +
+                                [get_limit_key(marvin.name) for marvin in marvins] +
+                                [get_heartbeat_key(marvin.name) for marvin in marvins] +
+                                [get_running_key(marvin.name) for marvin in marvins])
+
+        generation = values.get(GENERATION_KEY)
+        if generation is None:
+            # Lost from the cache, start a new generation
+            cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+            generation = cache.get(GENERATION_KEY)
+
+        return generation, values
+
+    def get_scores(self, instance_types):
+        """
+        Score the Marvins of each of the instance types, best first
+        """
+        generation, values = self.get_state(instance_types)
+        if generation is None or generation != self.generation:
+            # Without a generation the cache is unavailable, and we can't know if our Marvins are still current
+            with self.lock:
+                if generation is None or generation != self.generation:
+                    self.load(generation)
+
+            generation, values = self.get_state(instance_types)
+
+        scorer = get_scorer()
+        scores = {}
+        for instance_type in instance_types:
+            scores[instance_type] = []
+            for marvin in self.by_type.get(instance_type, []):
+                # The Marvin may be busier than our leases show
+                tasks = max(count_leases(values, marvin.name, marvin.parallel_tasks_limit),
+                            get_reported_tasks(values, marvin.name))
+                limit = get_effective_limit(values, marvin)
+                stats = values.get(get_stats_key(marvin.name), {})
+                scores[instance_type].append(MarvinState(
+                    marvin=marvin,
+                    tasks=tasks,
+                    limit=limit,
+                    stats=stats,
+                    circuit=get_circuit_state(values, marvin.name),
+                    silent=is_silent(values, marvin.name),
+                    score=scorer(marvin, tasks, limit, stats),
+                ))
+            scores[instance_type].sort(key=lambda state: state.score)
+
+        return scores
+
+    def get_available(self, instance_types):
+        """
+        Return the Marvins that have capacity left, whose circuit isn't open and that haven't missed their heartbeats
+        for each of the instance types, best first
+        """
+        return {instance_type: [state for state in states
+                                if state.tasks < state.limit and state.circuit != OPEN and not state.silent]
+                for instance_type, states in self.get_scores(instance_types).items()}
+
+
+marvin_registry = MarvinRegistry()
@@ -0,0 +1,35 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Assumed /browse latency in seconds of a Marvin we have no measurements of yet
+DEFAULT_BROWSE_LATENCY = 10.0
+
+# How much a Marvin that always fails is penalised compared to one that never fails
+ERROR_PENALTY = 10.0
+
+
+def get_scorer():
+    return import_string(settings.MARVIN_SCORER)
+
+
+def task_count_score(marvin, tasks, limit, stats):
+    """
+    Only look at the number of running tasks, like in the old days
+    """
+    return tasks
+
+
+def expected_latency_score(marvin, tasks, limit, stats):
+    """
+    Estimate how long a new task would take on this Marvin: the busier it is compared to its limit and the slower it
+    has been, the longer. Recent errors make it less attractive. Lower is better.
+    """
+    load = (tasks + 1) / limit
+    latency = stats.get('browse_latency') or DEFAULT_BROWSE_LATENCY
+    error_rate = stats.get('error_rate') or 0.0
+    return load * latency * (1 + ERROR_PENALTY * error_rate)
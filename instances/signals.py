@@ -0,0 +1,46 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from instances.connections import retire_marvin_pool
+from instances.models import Marvin, Zaphod
+from instances.registry import invalidate_marvin_registry
+from instances.zaphods import invalidate_zaphod
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Marvin, dispatch_uid='retire_dead_marvin_pool')
+def retire_dead_marvin_pool(instance: Marvin, **kwargs):
+    if not instance.is_alive:
+        retire_marvin_pool(instance.name)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Marvin, dispatch_uid='invalidate_marvin_registry_on_save')
+@receiver(post_delete, sender=Marvin, dispatch_uid='invalidate_marvin_registry_on_delete')
+def reload_marvin_registry(**kwargs):
+    # Let all processes reload their Marvins
+    invalidate_marvin_registry()
+
+
+# noinspection PyUnusedLocal
+@receiver(pre_save, sender=Zaphod, dispatch_uid='remember_zaphod_hostname')
+def remember_zaphod_hostname(instance: Zaphod, **kwargs):
+    # The old hostname must be forgotten as well when it changes
+    if instance.pk:
+        instance.previous_hostname = Zaphod.objects.filter(pk=instance.pk).values_list('hostname', flat=True).first()
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Zaphod, dispatch_uid='invalidate_zaphod_on_save')
+@receiver(post_delete, sender=Zaphod, dispatch_uid='invalidate_zaphod_on_delete')
+def reload_zaphod(instance: Zaphod, **kwargs):
+    invalidate_zaphod(instance.hostname)
+
+    previous_hostname = getattr(instance, 'previous_hostname', None)
+    if previous_hostname and previous_hostname != instance.hostname:
+        invalidate_zaphod(previous_hostname)
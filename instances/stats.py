@@ -0,0 +1,90 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Weight of the newest sample in the moving averages
+ALPHA = 0.2
+
+# Stats of Marvins that haven't been used for a day are forgotten
+STATS_TIMEOUT = 86400
+
+# Number of recent latencies kept to determine percentiles, and how many are needed before they mean anything
+SAMPLE_COUNT = 200
+MIN_SAMPLES = 20
+
+
+def get_stats_key(name):
+    return 'marvin_{}_stats'.format(name)
+
+
+def moving_average(average, sample):
+    if average is None:
+        return sample
+    return average + ALPHA * (sample - average)
+
+
+def record_request(name, endpoint, duration, success):
+    """
+    Update the moving averages of a Marvin. Updates from different processes may overwrite each other, which is fine
+    for statistics like these.
+    """
+    key = get_stats_key(name)
+    stats = cache.get(key) or {}
+
+    stats['error_rate'] = moving_average(stats.get('error_rate'), 0.0 if success else 1.0)
+    if success and endpoint == 'browse':
+        stats['browse_latency'] = moving_average(stats.get('browse_latency'), duration)
+
+    cache.set(key, stats, STATS_TIMEOUT)
+
+
+def get_latency_key(instance_type, endpoint):
+    return 'latency_{}_{}'.format(instance_type, endpoint)
+
+
+def get_marvin_latency_key(name, endpoint):
+    return 'marvin_{}_latency_{}'.format(name, endpoint)
+
+
+def record_latency(marvin, endpoint, duration):
+    """
+    Keep the latency of a successful request, both for the instance type and for the Marvin itself
+    """
+    keys = [get_latency_key(marvin.instance_type, endpoint), get_marvin_latency_key(marvin.name, endpoint)]
+    values = cache.get_many(keys)
+    cache.set_many({key: (values.get(key, []) + [duration])[-SAMPLE_COUNT:] for key in keys}, STATS_TIMEOUT)
+
+
+def get_percentile(samples, percentile):
+    """
+    Return the latency below which this percentage of the samples is, or None without enough samples
+    """
+    if len(samples) < MIN_SAMPLES:
+        return None
+
+    samples = sorted(samples)
+    return samples[max(int(math.ceil(percentile / 100 * len(samples))) - 1, 0)]
+
+
+def get_latency_percentile(instance_type, endpoint, percentile):
+    return get_percentile(cache.get(get_latency_key(instance_type, endpoint)) or [], percentile)
+
+
+def get_timeout(name, endpoint):
+    """
+    Learn how long to wait for this endpoint of a Marvin from its recent latencies, within the limits of
+    settings.MARVIN_TIMEOUTS. Without enough history the ceiling is used.
+    """
+    floor, ceiling = settings.MARVIN_TIMEOUTS[endpoint]
+    latency = get_percentile(cache.get(get_marvin_latency_key(name, endpoint)) or [],
+                             settings.MARVIN_TIMEOUT_PERCENTILE)
+    if latency is None:
+        return ceiling
+
+    return min(max(latency * settings.MARVIN_TIMEOUT_FACTOR, floor), ceiling)
@@ -0,0 +1,61 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import asyncio
+from collections import deque
+from contextlib import contextmanager
+
+from generic.async_utils import get_event_loop
+
+
+class MarvinWaiter:
+    def __init__(self, instance_types):
+        self.instance_types = instance_types
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        self.event.clear()
+
+
+class MarvinWaitQueue:
+    """
+    Runs in this process that are waiting for Marvin capacity, oldest first per instance type
+    """
+
+    def __init__(self):
+        self.waiters = {}
+
+    @contextmanager
+    def waiter(self, instance_types):
+        waiter = MarvinWaiter(instance_types)
+        for instance_type in instance_types:
+            self.waiters.setdefault(instance_type, deque()).append(waiter)
+
+        try:
+            yield waiter
+        finally:
+            for instance_type in instance_types:
+                self.waiters[instance_type].remove(waiter)
+
+    def _wake(self, instance_type):
+        for waiter in self.waiters.get(instance_type, ()):
+            if not waiter.event.is_set():
+                waiter.event.set()
+                return
+
+    def wake(self, instance_type):
+        """
+        Wake the oldest run waiting for this instance type. This can be called from any thread.
+        """
+        if self.waiters.get(instance_type):
+            get_event_loop().call_soon_threadsafe(self._wake, instance_type)
+
+
+marvin_wait_queue = MarvinWaitQueue()
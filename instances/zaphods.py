@@ -0,0 +1,62 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from generic.utils import TokenAuth
+
+# How long Zaphod credentials are remembered, changes through the ORM invalidate them right away
+ZAPHOD_CACHE_TIME = 3600
+
+# Process-wide sessions with keep-alive connections, by Zaphod pk
+_sessions = {}
+
+
+def get_zaphod_key(hostname):
+    return 'zaphod_{}'.format(hostname)
+
+
+def get_zaphod(hostname):
+    """
+    Find the Zaphod with this hostname without going to the database every time
+    """
+    from instances.models import Zaphod
+
+    zaphod = cache.get(get_zaphod_key(hostname))
+    if zaphod is None:
+        # Remember unknown hostnames as well
+        zaphod = Zaphod.objects.filter(hostname=hostname).first() or False
+        cache.set(get_zaphod_key(hostname), zaphod, ZAPHOD_CACHE_TIME)
+
+    return zaphod or None
+
+
+def invalidate_zaphod(hostname):
+    cache.delete(get_zaphod_key(hostname))
+
+
+def get_zaphod_session(zaphod):
+    """
+    Get a session for talking to this Zaphod, which keeps its connections open and authenticates by itself
+    """
+    signature = (zaphod.token, zaphod.max_connections)
+    current = _sessions.get(zaphod.pk)
+    if current and current[0] == signature:
+        return current[1]
+
+    if current:
+        # The Zaphod has changed, start over with a new session
+        current[1].close()
+
+    session = requests.Session()
+    session.auth = TokenAuth(zaphod.token)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=zaphod.max_connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    _sessions[zaphod.pk] = (signature, session)
+    return session
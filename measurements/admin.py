@@ -15,7 +15,8 @@ from pygments import highlight
 from pygments.formatters.html import HtmlFormatter
 from pygments.lexers.data import JsonLexer
 
-from measurements.models import InstanceRun, InstanceRunMessage, InstanceRunResult
+from measurements.models import InstanceRun, InstanceRunMessage, InstanceRunResult, PendingCallback
+from measurements.tasks.updater import replay_callbacks
 
 
 class InstanceRunMessageAdmin(admin.TabularInline):
@@ -24,8 +25,8 @@ class InstanceRunMessageAdmin(admin.TabularInline):
 
 class InlineInstanceRunResult(admin.TabularInline):
     model = InstanceRunResult
-    fields = ('marvin', 'when', 'nice_ping_response', 'nice_web_response', 'data_image')
-    readonly_fields = ('marvin', 'when', 'nice_ping_response', 'nice_web_response', 'data_image')
+    fields = ('marvin', 'browse_marvin', 'when', 'nice_ping_response', 'nice_web_response', 'data_image')
+    readonly_fields = ('marvin', 'browse_marvin', 'when', 'nice_ping_response', 'nice_web_response', 'data_image')
     extra = 0
     can_delete = False
     show_change_link = True
@@ -115,3 +116,22 @@ class InstanceRunResultAdmin(admin.ModelAdmin):
                      'marvin_type',
                      'marvin__name',)
     autocomplete_fields = ('instancerun',)
+
+
+@admin.register(PendingCallback)
+class PendingCallbackAdmin(admin.ModelAdmin):
+    list_display = ('instancerun', 'zaphod', 'attempts', 'next_attempt', 'dead', 'last_error')
+    list_filter = ('dead', 'zaphod')
+    search_fields = ('instancerun__url',)
+    readonly_fields = ('instancerun', 'zaphod', 'revision', 'created', 'attempts', 'next_attempt', 'last_error',
+                       'dead')
+    actions = ('replay',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def replay(self, request, queryset):
+        count = replay_callbacks(queryset)
+        self.message_user(request, _('{count} dead callbacks will be delivered again').format(count=count))
+
+    replay.short_description = _('Replay selected dead callbacks')
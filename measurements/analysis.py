@@ -0,0 +1,124 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import asyncio
+import json
+import multiprocessing
+import tempfile
+from collections import OrderedDict
+
+import ijson
+from django.conf import settings
+
+_analysis_slots = None
+
+
+def get_analysis_slots():
+    global _analysis_slots
+    if _analysis_slots is None:
+        _analysis_slots = asyncio.Semaphore(settings.ANALYSIS_WORKERS)
+    return _analysis_slots
+
+
+def analysis_process(connection, func, args):
+    try:
+        connection.send((None, func(*args)))
+    except Exception as ex:
+        connection.send((ex, None))
+    finally:
+        connection.close()
+
+
+async def run_analysis(stage, func, *args):
+    """
+    Run CPU-bound analysis in a process of its own, so it doesn't hold up the event loop. Every stage has its own
+    timeout in settings.ANALYSIS_TIMEOUTS, after which only that process is stopped. At most
+    settings.ANALYSIS_WORKERS analyses run at the same time. Without workers the analysis runs in a thread of this
+    process, which can't be stopped, so there the timeout only limits how long we wait.
+    """
+    loop = asyncio.get_event_loop()
+    if not settings.ANALYSIS_WORKERS:
+        return await asyncio.wait_for(loop.run_in_executor(None, func, *args),
+                                      timeout=settings.ANALYSIS_TIMEOUTS[stage])
+
+    async with get_analysis_slots():
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=analysis_process, args=(sender, func, args), daemon=True)
+        process.start()
+        sender.close()
+
+        # The pipe becomes readable when the result is there, or when the process died without one
+        readable = loop.create_future()
+        loop.add_reader(receiver.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout=settings.ANALYSIS_TIMEOUTS[stage])
+            try:
+                error, result = receiver.recv()
+            except EOFError:
+                raise RuntimeError('The {stage} analysis process died'.format(stage=stage))
+        finally:
+            loop.remove_reader(receiver.fileno())
+            receiver.close()
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    if error is not None:
+        raise error
+
+    return result
+
+
+def parse_json_documents(documents: dict):
+    return {key: json.loads(content.decode('utf-8'), object_pairs_hook=OrderedDict)
+            for key, content in documents.items()}
+
+
+class BrowseDocument:
+    """
+    A parsed /browse response. The screenshot stays in a file until the result is stored.
+    """
+
+    def __init__(self, data, image_path=None):
+        self.data = data
+        self.image_path = image_path
+
+    @classmethod
+    def from_web_response(cls, web_response, workdir):
+        data = OrderedDict(web_response)
+        image = data.pop('image', None)
+        if image is None:
+            return cls(data)
+
+        with tempfile.NamedTemporaryFile(mode='w', dir=workdir, suffix='.image', delete=False) as f:
+            f.write(image)
+
+        return cls(data, f.name)
+
+    def web_response(self):
+        web_response = OrderedDict(self.data)
+        if self.image_path:
+            with open(self.image_path) as f:
+                web_response['image'] = f.read()
+        return web_response
+
+
+def parse_browse_document(path):
+    """
+    Parse a spooled /browse response incrementally. Only the structured parts are returned, the screenshot is
+    written to a file next to it.
+    """
+    data = OrderedDict()
+    image_path = None
+    with open(path, 'rb') as f:
+        for key, value in ijson.kvitems(f, '', map_type=OrderedDict, use_float=True):
+            if key == 'image':
+                image_path = path + '.image'
+                with open(image_path, 'w') as image_file:
+                    image_file.write(value)
+            else:
+                data[key] = value
+
+    return BrowseDocument(data, image_path)
@@ -13,8 +13,9 @@ from measurements.models import InstanceRun, InstanceRunMessage, InstanceRunResu
 class InstanceRunResultsSerializer(SerializerExtensionsMixin, HyperlinkedModelSerializer):
     class Meta:
         model = InstanceRunResult
-        fields = ('id', 'instancerun', 'instancerun_id', 'marvin', 'when', 'ping_response', 'web_response', '_url')
-        read_only_fields = ('marvin', 'instance_type', 'ping_response', 'web_response')
+        fields = ('id', 'instancerun', 'instancerun_id', 'marvin', 'browse_marvin', 'when', 'ping_response',
+                  'web_response', '_url')
+        read_only_fields = ('marvin', 'browse_marvin', 'instance_type', 'ping_response', 'web_response')
         expandable_fields = dict(
             marvin=dict(
                 serializer=MarvinSerializer,
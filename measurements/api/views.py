@@ -3,11 +3,16 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+import json
+from collections import OrderedDict
+
 from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from rest_framework_serializer_extensions.views import SerializerExtensionsAPIViewMixin
 
 from measurements.api.serializers import InstanceRunResultsSerializer, InstanceRunSerializer
+from measurements.documents import get_callback_document
 from measurements.models import InstanceRun, InstanceRunResult
 
 
@@ -48,6 +53,20 @@ class InstanceRunViewSet(SerializerExtensionsAPIViewMixin, ModelViewSet):
             context['expand'] = {'messages', 'results__marvin'}
         return context
 
+    def retrieve(self, request, *args, **kwargs):
+        if set(request.query_params) & {'expand', 'expand_id_only', 'exclude', 'only'}:
+            return super().retrieve(request, *args, **kwargs)
+
+        # The default representation is what we send to Zaphod plus the id and URL, so reuse that document
+        instance = self.get_object()
+        document = get_callback_document(instance)
+
+        data = OrderedDict()
+        data['id'] = instance.pk
+        data.update(json.loads(document.get_content().decode('utf-8'), object_pairs_hook=OrderedDict))
+        data['_url'] = self.get_serializer(instance).fields['_url'].to_representation(instance)
+        return Response(data)
+
 
 class InstanceRunResultsViewSet(ModelViewSet):
     """
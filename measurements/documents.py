@@ -0,0 +1,77 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import gzip
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from measurements.api.serializers import InstanceRunSerializer
+
+
+def serialize_instancerun(run):
+    return InstanceRunSerializer(instance=run, context={
+        'expand': {
+            'messages',
+            'results__marvin'
+        },
+        'exclude': {
+            'id',
+            '_url',
+            'results__id',
+            'results__instancerun',
+            'results__instancerun_id',
+            'results___url',
+            'results__marvin__id',
+            'results__marvin___url'
+        }
+    }).data
+
+
+def get_payload_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8')).hexdigest()
+
+
+def render_callback_document(run, store=True):
+    """
+    Render the document that tells Zaphod about the current revision of the run. Finished runs don't change anymore,
+    so their document is stored and every delivery attempt and API request after that can reuse it.
+    """
+    from measurements.models import CallbackDocument
+
+    data = serialize_instancerun(run)
+    content = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+    if settings.CALLBACK_DOCUMENT_GZIP:
+        content = gzip.compress(content)
+
+    document = CallbackDocument(instancerun=run, revision=run.revision, content=content,
+                                compressed=settings.CALLBACK_DOCUMENT_GZIP, hash=get_payload_hash(data))
+    if store:
+        CallbackDocument.objects.update_or_create(instancerun=run, defaults={
+            'revision': document.revision,
+            'content': document.content,
+            'compressed': document.compressed,
+            'hash': document.hash,
+        })
+
+    return document
+
+
+def get_callback_document(run):
+    """
+    Get the stored document of this revision of the run, or render it if there is none
+    """
+    from measurements.models import CallbackDocument
+
+    try:
+        document = run.callback_document
+        if document.revision == run.revision:
+            return document
+    except CallbackDocument.DoesNotExist:
+        pass
+
+    return render_callback_document(run, store=bool(run.finished))
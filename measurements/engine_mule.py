@@ -0,0 +1,21 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+"""
+Runs the asyncio engine in a uWSGI mule (see uwsgi.ini). Tasks it dispatches go to the spooler from here, outside
+of uWSGI they would run inline in the engine.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "trillian_be.settings")
+django.setup()
+
+# noinspection PyPep8
+from django.core.management import call_command
+
+call_command('runengine')
@@ -0,0 +1,108 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import base64
+import io
+import math
+
+import numpy as np
+import skimage.io
+from skimage.measure import compare_ssim
+
+# Size of the thumbnails used to quickly spot clearly different images
+THUMBNAIL_SIZE = 64
+
+# Thumbnails hide details, so they look more alike than the full images. A thumbnail score this far below
+# the threshold means the full images won't get near it either.
+THUMBNAIL_MARGIN = 0.05
+
+# The full comparison is done on images of at most this size
+COMPARE_SIZE = 1024
+
+# Luminance weights for RGB
+GRAYSCALE_WEIGHTS = np.array([0.2125, 0.7154, 0.0721], dtype=np.float32)
+
+
+def decode_base64_image(img_b64):
+    return skimage.io.imread(io.BytesIO(base64.b64decode(img_b64)))
+
+
+def downscale(img, max_size):
+    """
+    Average blocks of pixels so that the image fits in max_size, without converting the full image to floats first
+    """
+    factor = int(math.ceil(max(img.shape[:2]) / max_size))
+    if factor <= 1:
+        return img.astype(np.float32)
+
+    height = img.shape[0] // factor
+    width = img.shape[1] // factor
+    blocks = img[:height * factor, :width * factor].reshape((height, factor, width, factor) + img.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def grayscale(img):
+    if img.ndim == 2:
+        return img
+
+    if img.shape[-1] < 3:
+        # Already grayscale, possibly with an alpha channel that we ignore
+        return img[..., 0]
+
+    # Ignore the alpha channel
+    return img[..., :3] @ GRAYSCALE_WEIGHTS
+
+
+def compare_images(img1, img2, max_size):
+    gray1 = grayscale(downscale(img1, max_size))
+    gray2 = grayscale(downscale(img2, max_size))
+    if min(gray1.shape) < 7:
+        # Too small for SSIM's window
+        return None
+
+    return compare_ssim(gray1, gray2, data_range=255)
+
+
+def compare_pixels(img1, img2):
+    """
+    Similarity of images that are too small for SSIM, based on the average difference of their pixels
+    """
+    gray1 = grayscale(img1.astype(np.float32))
+    gray2 = grayscale(img2.astype(np.float32))
+    return float(1.0 - np.mean(np.abs(gray1 - gray2)) / 255)
+
+
+def compare_base64_images(img1_b64, img2_b64, threshold=0.98):
+    """
+    Return the similarity of two base64 encoded images, between 0 and 1. Cheap checks are done first, and the
+    expensive structural similarity is only calculated when the outcome is close to the threshold.
+    """
+    if img1_b64 == img2_b64:
+        return 1.0
+
+    img1 = decode_base64_image(img1_b64)
+    img2 = decode_base64_image(img2_b64)
+
+    # Screenshots of different sizes show different pages
+    if img1.shape != img2.shape:
+        return 0.0
+
+    if np.array_equal(img1, img2):
+        return 1.0
+
+    score = compare_images(img1, img2, THUMBNAIL_SIZE)
+    if score is not None and score < threshold - THUMBNAIL_MARGIN:
+        return score
+
+    score = compare_images(img1, img2, COMPARE_SIZE)
+    if score is None:
+        return compare_pixels(img1, img2)
+
+    return score
+
+
+def compare_image_files(path1, path2, threshold=0.98):
+    with open(path1) as f1, open(path2) as f2:
+        return compare_base64_images(f1.read(), f2.read(), threshold)
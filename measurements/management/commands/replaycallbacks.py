@@ -0,0 +1,28 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+
+from measurements.models import PendingCallback
+from measurements.tasks.updater import replay_callbacks
+
+
+class Command(BaseCommand):
+    help = 'Deliver dead callbacks to Zaphod again'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zaphod', action='append', default=[],
+                            help='Only replay callbacks to the Zaphod with this name, can be given more than once')
+
+    def handle(self, *args, **options):
+        callbacks = PendingCallback.objects.all()
+        if options['zaphod']:
+            callbacks = callbacks.filter(zaphod__name__in=options['zaphod'])
+
+        count = replay_callbacks(callbacks)
+        self.stdout.write(self.style.SUCCESS(
+            _('{count} dead callbacks will be delivered again by the spooler').format(count=count)
+        ))
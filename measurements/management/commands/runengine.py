@@ -0,0 +1,36 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from generic.async_utils import run_sync
+from measurements.tasks.engine import InstanceRunEngine
+
+try:
+    # noinspection PyPackageRequirements
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+
+class Command(BaseCommand):
+    help = 'Run InstanceRuns concurrently in the asyncio engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.ASYNC_ENGINE_CONCURRENCY,
+                            help='Maximum number of InstanceRuns in flight')
+
+    def handle(self, *args, **options):
+        if not settings.ASYNC_ENGINE:
+            raise CommandError('The asyncio engine is not enabled, set TRILLIAN_ASYNC_ENGINE')
+
+        if not uwsgi:
+            # Without uWSGI the tasks the engine dispatches would run inline, inside the engine
+            raise CommandError('The asyncio engine has to run in a uWSGI mule, see uwsgi.ini')
+
+        engine = InstanceRunEngine(concurrency=options['concurrency'],
+                                   poll_interval=settings.ASYNC_ENGINE_POLL_INTERVAL)
+        run_sync(engine.run_forever())
@@ -0,0 +1,22 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('measurements', '0005_instancerunmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instancerun',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='revision'),
+        ),
+    ]
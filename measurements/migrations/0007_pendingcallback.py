@@ -0,0 +1,39 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0009_zaphod_bulk_callback_url'),
+        ('measurements', '0006_instancerun_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCallback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField(verbose_name='revision')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('instancerun', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                  related_name='pending_callbacks', to='measurements.InstanceRun',
+                                                  verbose_name='instance run')),
+                ('zaphod', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                             related_name='pending_callbacks', to='instances.Zaphod',
+                                             verbose_name='Zaphod')),
+            ],
+            options={
+                'verbose_name': 'pending callback',
+                'verbose_name_plural': 'pending callbacks',
+                'ordering': ('zaphod', 'created'),
+            },
+        ),
+    ]
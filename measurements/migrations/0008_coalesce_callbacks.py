@@ -0,0 +1,40 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_callbacks(apps, schema_editor):
+    # Only the newest pending callback of each run is kept, it delivers the latest state anyway
+    PendingCallback = apps.get_model('measurements', 'PendingCallback')
+    seen = set()
+    for callback in PendingCallback.objects.order_by('instancerun_id', '-revision', '-pk'):
+        if callback.instancerun_id in seen:
+            callback.delete()
+        seen.add(callback.instancerun_id)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('measurements', '0007_pendingcallback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instancerun',
+            name='delivered_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, verbose_name='delivered hash'),
+        ),
+        migrations.RunPython(remove_duplicate_callbacks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='pendingcallback',
+            name='instancerun',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_callback',
+                                       to='measurements.InstanceRun', verbose_name='instance run'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('measurements', '0008_coalesce_callbacks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallbackDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision', models.PositiveIntegerField(verbose_name='revision')),
+                ('rendered', models.DateTimeField(auto_now=True, verbose_name='rendered')),
+                ('content', models.BinaryField(verbose_name='content')),
+                ('compressed', models.BooleanField(default=False, verbose_name='compressed')),
+                ('hash', models.CharField(max_length=40, verbose_name='hash')),
+                ('instancerun', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                                     related_name='callback_document', to='measurements.InstanceRun',
+                                                     verbose_name='instance run')),
+            ],
+            options={
+                'verbose_name': 'callback document',
+                'verbose_name_plural': 'callback documents',
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:11
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('measurements', '0009_callbackdocument'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='pendingcallback',
+            options={'ordering': ('zaphod', 'next_attempt'), 'verbose_name': 'pending callback',
+                     'verbose_name_plural': 'pending callbacks'},
+        ),
+        migrations.AddField(
+            model_name='pendingcallback',
+            name='dead',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='dead'),
+        ),
+        migrations.AddField(
+            model_name='pendingcallback',
+            name='last_error',
+            field=models.CharField(blank=True, max_length=200, verbose_name='last error'),
+        ),
+        migrations.AddField(
+            model_name='pendingcallback',
+            name='next_attempt',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='next attempt'),
+        ),
+    ]
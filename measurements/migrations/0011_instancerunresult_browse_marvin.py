@@ -0,0 +1,32 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+# Generated by Django 2.0.13 on 2026-10-18 19:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('instances', '0010_zaphod_max_connections'),
+        ('measurements', '0010_dead_callbacks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instancerunresult',
+            name='browse_marvin',
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The Marvin that answered the browse, when it wasn't this one",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name='+',
+                to='instances.Marvin',
+                verbose_name='browse Marvin'
+            ),
+        ),
+    ]
@@ -3,14 +3,16 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+import gzip
 import logging
 
 from django.contrib.gis.db import models
 from django.contrib.postgres.fields import ArrayField, JSONField
+from django.utils import timezone
 from django.utils.formats import date_format
 from django.utils.translation import gettext_lazy as _
 
-from instances.models import Marvin
+from instances.models import Marvin, Zaphod
 
 severities = (
     (logging.CRITICAL, _('Critical')),
@@ -32,6 +34,12 @@ class InstanceRun(models.Model):
 
     dns_results = ArrayField(models.GenericIPAddressField(), verbose_name=_('DNS results'), blank=True, default=list)
 
+    # Incremented on every save, so tasks know which version of the run they were scheduled for
+    revision = models.PositiveIntegerField(_('revision'), default=0, editable=False)
+
+    # Hash of the last data the Zaphod accepted, to skip updates that don't change anything
+    delivered_hash = models.CharField(_('delivered hash'), max_length=40, blank=True, editable=False)
+
     class Meta:
         verbose_name = _('instance run')
         verbose_name_plural = _('instance runs')
@@ -48,6 +56,10 @@ class InstanceRun(models.Model):
             return _('{url} requested on {when}').format(url=self.url,
                                                          when=date_format(self.requested, 'DATETIME_FORMAT'))
 
+    def save(self, *args, **kwargs):
+        self.revision += 1
+        super().save(*args, **kwargs)
+
 
 class InstanceRunMessage(models.Model):
     instancerun = models.ForeignKey(InstanceRun, verbose_name=_('instance run'), related_name='messages',
@@ -69,6 +81,11 @@ class InstanceRunResult(models.Model):
                                     on_delete=models.CASCADE)
     marvin = models.ForeignKey(Marvin, verbose_name=_('Marvin'), on_delete=models.PROTECT)
 
+    # A slow browse may have been answered by another Marvin of the same type, the pings are always from this one
+    browse_marvin = models.ForeignKey(Marvin, verbose_name=_('browse Marvin'), related_name='+', blank=True,
+                                      null=True, on_delete=models.PROTECT,
+                                      help_text=_('The Marvin that answered the browse, when it wasn\'t this one'))
+
     when = models.DateTimeField(auto_now_add=True)
 
     ping_response = JSONField()
@@ -84,3 +101,49 @@ class InstanceRunResult(models.Model):
     @property
     def instance_type(self):
         return self.marvin.instance_type
+
+
+class CallbackDocument(models.Model):
+    instancerun = models.OneToOneField(InstanceRun, verbose_name=_('instance run'), related_name='callback_document',
+                                       on_delete=models.CASCADE)
+    revision = models.PositiveIntegerField(_('revision'))
+    rendered = models.DateTimeField(_('rendered'), auto_now=True)
+
+    # The JSON document as sent to Zaphod, optionally compressed
+    content = models.BinaryField(_('content'))
+    compressed = models.BooleanField(_('compressed'), default=False)
+    hash = models.CharField(_('hash'), max_length=40)
+
+    class Meta:
+        verbose_name = _('callback document')
+        verbose_name_plural = _('callback documents')
+
+    def __str__(self):
+        return _('{obj.instancerun} revision {obj.revision}').format(obj=self)
+
+    def get_content(self):
+        content = bytes(self.content)
+        return gzip.decompress(content) if self.compressed else content
+
+
+class PendingCallback(models.Model):
+    instancerun = models.OneToOneField(InstanceRun, verbose_name=_('instance run'), related_name='pending_callback',
+                                       on_delete=models.CASCADE)
+    zaphod = models.ForeignKey(Zaphod, verbose_name=_('Zaphod'), related_name='pending_callbacks',
+                               on_delete=models.CASCADE)
+    revision = models.PositiveIntegerField(_('revision'))
+    created = models.DateTimeField(_('created'), auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    next_attempt = models.DateTimeField(_('next attempt'), default=timezone.now, db_index=True)
+    last_error = models.CharField(_('last error'), max_length=200, blank=True)
+
+    # Callbacks that failed too often are kept here until they are replayed
+    dead = models.BooleanField(_('dead'), default=False, db_index=True)
+
+    class Meta:
+        verbose_name = _('pending callback')
+        verbose_name_plural = _('pending callbacks')
+        ordering = ('zaphod', 'next_attempt')
+
+    def __str__(self):
+        return _('{obj.instancerun} to {obj.zaphod}').format(obj=self)
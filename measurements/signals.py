@@ -3,26 +3,27 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from measurements.models import InstanceRun
-from measurements.tasks import execute_instancerun, execute_update_zaphod
+from measurements.tasks import dispatch_instancerun, dispatch_update_zaphod
 
 
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=InstanceRun, dispatch_uid='schedule_execution')
 def schedule_execution(instance: InstanceRun, **kwargs):
-    if instance.started:
+    if instance.started or settings.ASYNC_ENGINE:
+        # The asyncio engine picks up runs from the database by itself
         return
 
     # Schedule execution for the spooler
-    execute_instancerun.setup['at'] = instance.requested
-    execute_instancerun(instance.pk)
+    dispatch_instancerun(instance)
 
 
 # noinspection PyUnusedLocal
 @receiver(post_save, sender=InstanceRun, dispatch_uid='schedule_updater')
 def schedule_updater(instance: InstanceRun, **kwargs):
     # Schedule update in the spooler
-    execute_update_zaphod(instance.pk)
+    dispatch_update_zaphod(instance)
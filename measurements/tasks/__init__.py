@@ -3,5 +3,5 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
-from .runner import execute_instancerun
-from .updater import execute_update_zaphod
+from .runner import dispatch_instancerun, execute_instancerun
+from .updater import dispatch_update_zaphod, execute_update_zaphod
@@ -0,0 +1,108 @@
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+#  Copyright (c) 2018, S.J.M. Steffann. This software is licensed under the BSD
+#  3-Clause License. Please see the LICENSE file in the project root directory.
+# ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
+
+import asyncio
+
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from uwsgi_tasks import RetryTaskException
+
+from generic.async_utils import database_sync
+from generic.utils import print_error, print_notice
+from instances.connections import prune_marvin_pools
+from measurements.tasks.runner import run_instancerun
+
+
+def find_runnable_instanceruns(exclude, limit):
+    from measurements.models import InstanceRun
+
+    return list(InstanceRun.objects
+                .filter(started__isnull=True, requested__lte=timezone.now())
+                .exclude(pk__in=exclude)
+                .order_by('requested')
+                .values_list('pk', flat=True)[:limit])
+
+
+class InstanceRunEngine:
+    """
+    Keeps many InstanceRuns in flight in a single process. Runs that are due are picked up from the database,
+    and failed runs are retried with the same limits as the spooler uses.
+    """
+
+    def __init__(self, concurrency, poll_interval, retry_count=5, retry_timeout=300):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.retry_count = retry_count
+        self.retry_timeout = retry_timeout
+
+        self.running = {}
+        self.attempts = {}
+        self.deferred = {}
+        self.given_up = set()
+        self.wakeup = None
+
+    def start(self, pk):
+        retries_left = self.retry_count - self.attempts.get(pk, 0)
+        future = asyncio.ensure_future(run_instancerun(pk, retries_left))
+        future.add_done_callback(lambda f: self.finished(pk, f))
+        self.running[pk] = future
+
+    def finished(self, pk, future):
+        del self.running[pk]
+        self.wakeup.set()
+
+        if future.cancelled():
+            return
+
+        ex = future.exception()
+        if isinstance(ex, RetryTaskException):
+            # A count means: retry without lowering the retry count
+            if ex.count is None:
+                self.attempts[pk] = self.attempts.get(pk, 0) + 1
+                if self.attempts[pk] >= self.retry_count:
+                    print_error(_("InstanceRun {pk} failed {count} times, giving up").format(
+                        pk=pk,
+                        count=self.attempts[pk]
+                    ))
+                    del self.attempts[pk]
+                    self.given_up.add(pk)
+                    return
+
+            timeout = ex.timeout or self.retry_timeout
+            self.deferred[pk] = asyncio.get_event_loop().time() + timeout
+
+        elif ex:
+            print_error(_("InstanceRun {pk} crashed: {ex}").format(pk=pk, ex=ex))
+
+        else:
+            self.attempts.pop(pk, None)
+
+    def excluded(self):
+        now = asyncio.get_event_loop().time()
+        for pk, not_before in list(self.deferred.items()):
+            if not_before <= now:
+                del self.deferred[pk]
+
+        return set(self.running) | set(self.deferred) | self.given_up
+
+    async def run_forever(self):
+        print_notice(_("Engine started, running up to {concurrency} InstanceRuns concurrently").format(
+            concurrency=self.concurrency
+        ))
+
+        self.wakeup = asyncio.Event()
+        while True:
+            self.wakeup.clear()
+            await prune_marvin_pools()
+
+            available = self.concurrency - len(self.running)
+            if available > 0:
+                for pk in await database_sync(find_runnable_instanceruns, self.excluded(), available):
+                    self.start(pk)
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -3,153 +3,435 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
-import base64
-import io
+import asyncio
 import ipaddress
 import logging
+import shutil
 import socket
 import sys
-from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor
-from contextlib import ExitStack
+import tempfile
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
 from ipaddress import IPv6Address
 from random import randrange
 from traceback import format_exc
 from urllib.parse import urlparse
 
-import requests
-import skimage.io
+import aiohttp
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _, gettext_noop
-from requests_futures.sessions import FuturesSession
-from skimage.measure import compare_ssim
-from uwsgi_tasks import RetryTaskException, get_current_task, task
-
-from generic.utils import print_error, print_message, print_notice, print_warning, retry_get
-from instances.models import Marvin
+from uwsgi_tasks import RetryTaskException, TaskExecutor, get_current_task, task
+
+from generic.async_utils import database_sync, gather_dict, run_sync
+from generic.utils import print_error, print_message, print_notice, print_warning
+from instances.circuits import HALF_OPEN, claim_probe, record_failure, record_success, release_probe
+from instances.concurrency import adjust_limit
+from instances.connections import get_marvin_pool, prune_marvin_pools
+from instances.leases import release_leases
+from instances.registry import marvin_registry
+from instances.stats import get_latency_percentile, get_timeout, record_latency, record_request
+from instances.waitqueue import marvin_wait_queue
+from measurements.analysis import BrowseDocument, parse_browse_document, parse_json_documents, run_analysis
+from measurements.documents import render_callback_document
+from measurements.images import compare_image_files
 from measurements.models import InstanceRunMessage
+from measurements.tasks.updater import dispatch_update_zaphod
 
+Measurement = namedtuple('Measurement', ['marvin', 'ping_response', 'document', 'browse_marvin'])
 
-# noinspection PyTypeChecker
-def compare_base64_images(img1_b64, img2_b64):
-    img1_bytes = base64.decodebytes(img1_b64.encode('ascii'))
-    img1 = skimage.io.imread(io.BytesIO(img1_bytes))
 
-    img2_bytes = base64.decodebytes(img2_b64.encode('ascii'))
-    img2 = skimage.io.imread(io.BytesIO(img2_bytes))
+def find_marvins(instance_types, exclude=()):
+    """
+    Reserve a slot on the least busy Marvin of each type. Returns the leases, or None for types without capacity.
+    """
+    available = marvin_registry.get_available(instance_types)
 
-    return compare_ssim(img1, img2, multichannel=True)
+    found = {}
+    for instance_type in instance_types:
+        found[instance_type] = None
+        for state in available[instance_type]:
+            if state.marvin.name in exclude:
+                continue
+
+            probe = None
+            if state.circuit == HALF_OPEN:
+                probe = claim_probe(state.marvin.name)
+                if not probe:
+                    # Someone else is already checking if this Marvin has recovered
+                    continue
+
+            # Another process may have taken the last slot since we looked
+            found[instance_type] = state.marvin.reserve(state.limit)
+            if found[instance_type]:
+                found[instance_type].probe = probe
+                break
+
+            if probe:
+                release_probe(state.marvin.name, probe)
 
+    return found
 
-def get_eligible_marvins():
-    # Find eligible Marvins
-    marvins = Marvin.objects.filter(is_alive=True)
-    possible_marvins = []
-    for marvin in marvins:
-        tasks = marvin.tasks
-        if tasks < marvin.parallel_tasks_limit:
-            possible_marvins.append((tasks, marvin))
 
-    # Sort them by tasks
-    possible_marvins.sort(key=lambda m: m[0])
+async def get_marvins(instance_types, retry_count):
+    """
+    Reserve a Marvin for each of the instance types. When there is no capacity the asyncio engine lets the run wait
+    in line, and wakes it when a slot is released in this process. Slots released elsewhere are picked up by
+    checking periodically. A spooler process would be occupied while waiting, so there the task is rescheduled
+    right away.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + (settings.MARVIN_WAIT_TIMEOUT if settings.ASYNC_ENGINE else 0)
+
+    with marvin_wait_queue.waiter(instance_types) as waiter:
+        while True:
+            leases = await database_sync(find_marvins, instance_types)
+            if all(leases.values()):
+                print_message(_("Found Marvins: {}").format(', '.join(['{}: {}'.format(instance_type,
+                                                                                       lease.marvin.name)
+                                                                       for instance_type, lease in leases.items()])))
+                return leases
+
+            # Don't keep the slots we did get while we wait, and don't wake ourselves by releasing them
+            await database_sync(release_leases, leases.values(), notify=False)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            await waiter.wait(min(remaining, settings.MARVIN_WAIT_INTERVAL))
+
+    timeout = randrange(5, 60)
+    print_error(_("Not enough Marvins available, missing {types}: delaying by {timeout} seconds").format(
+        types=[instance_type for instance_type, lease in leases.items() if lease is None],
+        timeout=timeout
+    ))
+    # Retry without lowering the retry count
+    raise RetryTaskException(count=retry_count, timeout=timeout)
+
+
+def record_marvin_response(marvin, endpoint, duration, status_code=None):
+    """
+    Keep track of how the Marvin is doing. A status code of None means there was no response at all.
+    """
+    success = status_code == 200
+    record_request(marvin.name, endpoint, duration, success=success)
+    if success:
+        record_latency(marvin, endpoint, duration)
+
+    if endpoint == 'browse':
+        adjust_limit(marvin, success=success)
+
+    if status_code is None or status_code >= 500:
+        record_failure(marvin.name)
+    else:
+        record_success(marvin.name)
+
+
+async def marvin_request(marvin, endpoint, data, spool_dir=None):
+    # The bookkeeping talks to the cache and the database, keep it off the event loop
+    loop = asyncio.get_event_loop()
+    timeout = aiohttp.ClientTimeout(connect=settings.MARVIN_CONNECT_TIMEOUT, sock_connect=5,
+                                    sock_read=await database_sync(get_timeout, marvin.name, endpoint))
+
+    # Time spent waiting for a free connection isn't the Marvin's
+    timing = {'connected': loop.time()}
+    try:
+        response = await get_marvin_pool(marvin).post(endpoint, data, timeout=timeout, spool_dir=spool_dir,
+                                                      timing=timing)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        await database_sync(record_marvin_response, marvin, endpoint, loop.time() - timing['connected'])
+        raise
 
-    return [marvin[1] for marvin in possible_marvins]
+    await database_sync(record_marvin_response, marvin, endpoint, loop.time() - timing['connected'],
+                        response.status_code)
+    return response
 
 
-def find_marvins(instance_types):
-    # Prepare the output
-    found = {}
-    for instance_type in instance_types:
-        found[instance_type] = None
+async def hedged_browse(instance_type, marvin, data, workdir):
+    """
+    Browse on the Marvin. If it is slower than settings.BROWSE_HEDGE_PERCENTILE of the recent browses of this
+    instance type, send the same request to another Marvin of that type too. The first good response wins, and is
+    returned together with the Marvin that sent it.
+    """
+    primary = asyncio.ensure_future(marvin_request(marvin, 'browse', data, spool_dir=workdir))
+    pending = {primary}
+    sources = {primary: marvin}
+    try:
+        delay = None
+        if settings.BROWSE_HEDGE_PERCENTILE:
+            delay = await database_sync(get_latency_percentile, instance_type, 'browse',
+                                        settings.BROWSE_HEDGE_PERCENTILE)
+
+        if delay is None or (await asyncio.wait(pending, timeout=delay))[0]:
+            return marvin, await primary
+
+        lease = (await database_sync(find_marvins, [instance_type], exclude={marvin.name}))[instance_type]
+        if not lease:
+            return marvin, await primary
+
+        async with lease:
+            print_notice(_("Browse on {marvin.name} is taking more than {delay:.1f} seconds, "
+                           "also trying {hedge.name}").format(marvin=marvin, delay=delay, hedge=lease.marvin))
+            hedge = asyncio.ensure_future(marvin_request(lease.marvin, 'browse', data, spool_dir=workdir))
+            pending.add(hedge)
+            sources[hedge] = lease.marvin
+
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if not future.exception() and future.result().status_code == 200:
+                        return sources[future], future.result()
+
+                if not pending:
+                    # Neither worked out
+                    future = done.pop()
+                    return sources[future], future.result()
+    finally:
+        # Cancel whatever is still running, the lease of the other Marvin has been released by now
+        for future in pending:
+            future.cancel()
+
+
+async def browse_baseline(run, marvin, slot, workdir):
+    # Release the Marvin as soon as we have the response
+    async with slot:
+        response = await marvin_request(marvin, 'browse', {
+            'url': run.url,
+        }, spool_dir=workdir)
+
+    if response.status_code != 200:
+        timeout = randrange(5, 120)
+        print_error(_("Baseline test failed, retrying in {timeout} seconds").format(
+            timeout=timeout
+        ))
+        raise RetryTaskException(timeout=timeout)
 
-    marvins = get_eligible_marvins()
-    for marvin in marvins:
-        # Skip if we don't need this type or if we already found one
-        if marvin.instance_type not in instance_types or found[marvin.instance_type]:
-            continue
+    return await run_analysis('parse', parse_browse_document, response.path)
 
-        found[marvin.instance_type] = marvin
 
-        # Stop if we found everything we need
-        if all(found.values()):
-            break
+def get_recent_baseline(url, workdir):
+    from measurements.models import InstanceRunResult
 
-    return found
+    if not settings.BASELINE_REUSE_TIMEOUT:
+        return None
 
+    recent = timezone.now() - timedelta(seconds=settings.BASELINE_REUSE_TIMEOUT)
+    result = InstanceRunResult.objects.filter(instancerun__url=url,
+                                              marvin__instance_type='dual-stack',
+                                              when__gte=recent).order_by('-when').first()
+    return BrowseDocument.from_web_response(result.web_response, workdir) if result else None
 
-def get_marvins(instance_types, current_task):
-    # We should now be the only spooler running this task
-    marvins = find_marvins(instance_types)
-    if not all(marvins.values()):
-        timeout = randrange(5, 60)
-        print_error(_("Not enough Marvins available, missing {types}: delaying by {timeout} seconds").format(
-            types=[instance_type for instance_type, marvin in marvins.items() if marvin is None],
-            timeout=timeout
-        ))
-        # Retry without lowering the retry count
-        raise RetryTaskException(count=current_task.setup['retry_count'], timeout=timeout)
 
-    print_message(_("Found Marvins: {}").format(', '.join(['{}: {}'.format(instance_type, marvin.name)
-                                                           for instance_type, marvin in marvins.items()])))
+def store_results(pk, measurements):
+    from measurements.models import InstanceRunResult
 
-    return marvins
+    # This is the only moment the screenshots are in memory, one at a time. The caller provides the transaction.
+    for measurement in measurements.values():
+        InstanceRunResult.objects.create(
+            instancerun_id=pk,
+            marvin=measurement.marvin,
+            browse_marvin=measurement.browse_marvin,
+            ping_response=measurement.ping_response,
+            web_response=measurement.document.web_response(),
+        )
 
 
-@task(retry_count=5, retry_timeout=300)
-def execute_instancerun(pk):
-    from measurements.models import InstanceRun, InstanceRunResult
+def store_messages(pk, messages):
+    # Messages are kept between attempts, so only add the new ones
+    existing = set(InstanceRunMessage.objects.filter(instancerun_id=pk).values_list('severity', 'message'))
+    InstanceRunMessage.objects.bulk_create([
+        InstanceRunMessage(instancerun_id=pk, severity=severity, message=message)
+        for severity, message in messages
+        if (severity, message) not in existing
+    ])
 
-    current_task = get_current_task()
+
+async def measure_instance_type(run, instance_type, marvin, slot, site_v4_addresses, site_v6_addresses, workdir):
+    # Start requests, the large browse response is streamed to disk
+    browse_request = hedged_browse(instance_type, marvin, {
+        'url': run.url,
+        'timeout': settings.MARVIN_BROWSE_TIMEOUT,
+    }, workdir)
+
+    marvin_has_v4 = instance_type in ('v4only', 'dual-stack')
+    marvin_has_nat64 = instance_type in ('nat64',)
+    marvin_has_v6 = instance_type in ('v6only', 'dual-stack', 'nat64')
+
+    ping_targets = OrderedDict()
+    if marvin_has_v4:
+        for address in site_v4_addresses:
+            ping_targets.setdefault('ping4', []).append(str(address))
+
+    if marvin_has_nat64:
+        for address in site_v4_addresses:
+            ping_targets.setdefault('ping6', []).append(str(IPv6Address('64:ff9b::') + int(address)))
+
+    if marvin_has_v6:
+        for address in site_v6_addresses:
+            ping_targets.setdefault('ping6', []).append(str(address))
+
+    # Marvins that support it get all targets of an endpoint in one request
+    batch_ping = 'batch-ping' in marvin.features
+
+    ping_requests = {}
+    for endpoint, targets in ping_targets.items():
+        if batch_ping:
+            ping_requests[endpoint] = marvin_request(marvin, endpoint, {
+                'targets': targets
+            })
+        else:
+            for target in targets:
+                ping_requests[target] = marvin_request(marvin, endpoint, {
+                    'target': target
+                })
+
+    # Wait for all the responses to come back in, and release the Marvin before analysing them
+    async with slot:
+        responses = await gather_dict({
+            'browse': browse_request,
+            'ping': gather_dict(ping_requests),
+        })
+    # The result belongs to the Marvin that pinged, a hedge that answered the browse is kept next to it
+    browse_marvin, browse_response = responses['browse']
+    ping_responses = responses['ping']
+
+    all_responses = [(instance_type, browse_response)] + [((instance_type, req), response)
+                                                           for req, response in ping_responses.items()]
+    for req, response in all_responses:
+        if response.status_code >= 300:
+            print_error("{req} {url} ({code}): {json}".format(code=response.status_code,
+                                                              req=req,
+                                                              url=response.url,
+                                                              json=response.json()))
+
+    # Check if all tests succeeded
+    if not all([response.status_code == 200 for req, response in all_responses]):
+        raise RetryTaskException
+
+    analysis = await gather_dict({
+        'browse': run_analysis('parse', parse_browse_document, browse_response.path),
+        'ping': run_analysis('parse', parse_json_documents, {key: response.content
+                                                             for key, response in ping_responses.items()}),
+    })
+    document = analysis['browse']
+    documents = analysis['ping']
+
+    # Put the responses in the shape of one response per target
+    ping_response = OrderedDict()
+    for endpoint, targets in ping_targets.items():
+        if batch_ping:
+            for target in targets:
+                ping_response[target] = documents[endpoint]['results'][target]
+        else:
+            for target in targets:
+                ping_response[target] = documents[target]
+
+    return Measurement(marvin, ping_response, document, browse_marvin if browse_marvin != marvin else None)
+
+
+async def measure(run, marvins, slots, site_v4_addresses, site_v6_addresses, workdir):
+    """
+    Measure all instance types concurrently. Failures don't affect the other instance types, they are returned
+    as exceptions instead of results.
+    """
+    instance_types = list(marvins.keys())
+    outcomes = await asyncio.gather(*[measure_instance_type(run, instance_type,
+                                                            marvins[instance_type], slots[instance_type],
+                                                            site_v4_addresses, site_v6_addresses, workdir)
+                                      for instance_type in instance_types],
+                                    return_exceptions=True)
+    return dict(zip(instance_types, outcomes))
+
+
+def get_measured_instance_types(run):
+    from measurements.models import InstanceRunResult
+
+    return set(InstanceRunResult.objects.filter(instancerun=run).values_list('marvin__instance_type', flat=True))
+
+
+def start_instancerun(pk):
+    from measurements.models import InstanceRun
+
+    # Make sure we need to start and we don't start twice
+    with transaction.atomic():
+        run = InstanceRun.objects.select_for_update().get(pk=pk)
+        if run.started:
+            print_notice(_('InstanceRun {pk} has already started, skipping').format(pk=pk))
+            return None
+
+        now = timezone.now()
+        if run.requested > now:
+            print_notice(_('InstanceRun {pk} is requested to start in the future, skipping').format(pk=pk))
+            return None
+
+        # We are starting!
+        run.started = now
+        run.save()
+
+    return run
+
+
+def finish_instancerun(run, measurements, messages):
+    from measurements.models import InstanceRun
+
+    # Store everything in one go. Updating the row directly doesn't trigger the post_save handlers of a
+    # started run, so tell Zaphod ourselves.
+    with transaction.atomic():
+        store_messages(run.pk, messages)
+        store_results(run.pk, measurements)
+        InstanceRun.objects.filter(pk=run.pk).update(dns_results=run.dns_results, finished=run.finished,
+                                                     revision=F('revision') + 1)
+        run.revision += 1
+
+        # Render what we tell Zaphod once, all deliveries and the API use it
+        render_callback_document(run)
+        dispatch_update_zaphod(run)
+
+
+def reset_instancerun(pk, measurements, messages):
+    from measurements.models import InstanceRun
+
+    # Clear the started timestamp so it can be retried. Successful measurements and messages are kept so that
+    # the next attempt only has to do the missing instance types.
+    with transaction.atomic():
+        store_messages(pk, messages)
+        store_results(pk, measurements)
+        InstanceRun.objects.filter(pk=pk).update(started=None, finished=None)
+
+
+async def run_instancerun(pk, retry_count):
+    from measurements.models import InstanceRun
+
+    loop = asyncio.get_event_loop()
+
+    # Large responses of this run are spooled here
+    workdir = tempfile.mkdtemp(prefix='instancerun-{}-'.format(pk))
+
+    # Everything is stored at the end
+    measurements = {}
+    messages = []
 
     try:
-        # Make sure we need to start and we don't start twice
-        with transaction.atomic():
-            run = retry_get(InstanceRun.objects.select_for_update(), pk=pk)
-            if run.started:
-                print_notice(_('InstanceRun {pk} has already started, skipping').format(pk=pk))
-                return
-
-            now = timezone.now()
-            if run.requested > now:
-                print_notice(_('InstanceRun {pk} is requested to start in the future, skipping').format(pk=pk))
-                return
-
-            # We are starting!
-            run.started = now
-            run.save()
+        run = await database_sync(start_instancerun, pk)
+        if not run:
+            return
 
         # Log which instancerun we're working on
         print_message(_("Start working on InstanceRun {run.pk} ({run.url})").format(run=run))
 
         # Do a simple DNS lookup
         addresses = set()
-        for info in socket.getaddrinfo(urlparse(run.url).hostname, port=80, proto=socket.IPPROTO_TCP):
+        for info in await loop.getaddrinfo(urlparse(run.url).hostname, 80, proto=socket.IPPROTO_TCP):
             family, socktype, proto, canonname, sockaddr = info
             addresses.add(ipaddress.ip_address(sockaddr[0]))
 
         run.dns_results = list([str(address) for address in addresses])
 
-        # First determine a baseline
-        marvin = get_marvins(['dual-stack'], current_task)['dual-stack']
-        with marvin:
-            response = requests.request(
-                method='POST',
-                url='http://{}:3001/browse'.format(marvin.name),
-                json={
-                    'url': run.url,
-                },
-                timeout=(5, 65)
-            )
-            if response.status_code != 200:
-                timeout = randrange(5, 120)
-                print_error(_("Baseline test failed, retrying in {timeout} seconds").format(
-                    timeout=timeout
-                ))
-                raise RetryTaskException(timeout=timeout)
-
-            baseline = response.json()
-
         # Determine which protocols to check
         site_v4_addresses = [address for address in addresses if address.version == 4]
         site_v6_addresses = [address for address in addresses if address.version == 6]
@@ -157,142 +439,111 @@ def execute_instancerun(pk):
         if site_v4_addresses:
             instance_types.add('v4only')
         else:
-            InstanceRunMessage.objects.create(
-                instancerun=run,
-                severity=logging.WARNING,
-                message=gettext_noop('This website has no IPv4 addresses so the IPv4-only test is skipped'),
-            )
+            messages.append((logging.WARNING,
+                             gettext_noop('This website has no IPv4 addresses so the IPv4-only test is skipped')))
 
         if site_v6_addresses:
             instance_types.add('v6only')
         else:
-            InstanceRunMessage.objects.create(
-                instancerun=run,
-                severity=logging.WARNING,
-                message=gettext_noop('This website has no IPv6 addresses so the IPv6-only test is skipped'),
-            )
-
-        marvins = get_marvins(instance_types, current_task)
-
-        with FuturesSession(executor=ThreadPoolExecutor(max_workers=2 * len(marvins))) as session:
-            with ExitStack() as stack:
-                # Signal usage of Marvins
-                for marvin in marvins.values():
-                    stack.enter_context(marvin)
-
-                # Start requests
-                browse_requests = {}
-                for instance_type, marvin in marvins.items():
-                    browse_requests[instance_type] = session.request(
-                        method='POST',
-                        url='http://{}:3001/browse'.format(marvin.name),
-                        json={
-                            'url': run.url,
-                            'timeout': 30,
-                        },
-                        timeout=(5, 65)
-                    )
-
-                ping_requests = {}
-                for instance_type, marvin in marvins.items():
-                    marvin_has_v4 = instance_type in ('v4only', 'dual-stack')
-                    marvin_has_nat64 = instance_type in ('nat64',)
-                    marvin_has_v6 = instance_type in ('v6only', 'dual-stack', 'nat64')
-
-                    if marvin_has_v4:
-                        for address in site_v4_addresses:
-                            address_str = str(address)
-                            ping_requests.setdefault(instance_type, {})[address_str] = session.request(
-                                method='POST',
-                                url='http://{}:3001/ping4'.format(marvin.name),
-                                json={'target': address_str},
-                                timeout=(5, 65)
-                            )
-
-                    if marvin_has_nat64:
-                        for address in site_v4_addresses:
-                            address_str = str(IPv6Address('64:ff9b::') + int(address))
-                            ping_requests.setdefault(instance_type, {})[address_str] = session.request(
-                                method='POST',
-                                url='http://{}:3001/ping6'.format(marvin.name),
-                                json={'target': address_str},
-                                timeout=(5, 65)
-                            )
-
-                    if marvin_has_v6:
-                        for address in site_v6_addresses:
-                            address_str = str(address)
-                            ping_requests.setdefault(instance_type, {})[address_str] = session.request(
-                                method='POST',
-                                url='http://{}:3001/ping6'.format(marvin.name),
-                                json={'target': address_str},
-                                timeout=(5, 65)
-                            )
-
-                # Wait for all the responses to come back in
-                browse_responses = {}
-                for instance_type, request in browse_requests.items():
-                    browse_responses[instance_type] = request.result()
-
-                ping_responses = {}
-                for instance_type, address_requests in ping_requests.items():
-                    for address, request in address_requests.items():
-                        ping_responses[(instance_type, address)] = request.result()
-
-            for req, response in list(browse_responses.items()) + list(ping_responses.items()):
-                if response.status_code >= 300:
-                    print_error("{req} {url} ({code}): {json}".format(code=response.status_code,
-                                                                      req=req,
-                                                                      url=response.url,
-                                                                      json=response.json()))
-
-            # Check if all tests succeeded
-            if not all([response.status_code == 200
-                        for response in list(browse_responses.values()) + list(ping_responses.values())]):
-                timeout = randrange(5, 120)
-                print_error(_("Not all tests completed successfully, retrying in {timeout} seconds").format(
-                    timeout=timeout
-                ))
-                raise RetryTaskException(timeout=timeout)
-
-            # Parse all JSON
-            ping_responses_json = {}
-            for (instance_type, address), response in ping_responses.items():
-                ping_responses_json.setdefault(instance_type, {})
-                ping_responses_json[instance_type][address] = response.json(object_pairs_hook=OrderedDict)
-            browse_responses_json = {instance_type: response.json(object_pairs_hook=OrderedDict)
-                                     for instance_type, response in browse_responses.items()}
-
-            # Compare dual-stack to the baseline
-            if len(baseline['resources']) != len(browse_responses_json['dual-stack']['resources']) or \
-                    compare_base64_images(baseline['image'], browse_responses_json['dual-stack']['image']) < 0.98:
-                InstanceRunMessage.objects.create(
-                    instancerun=run,
-                    severity=logging.WARNING,
-                    message=gettext_noop('Two identical requests returned different results. '
-                                         'Results are going to be unpredictable.'),
-                )
-
-            for instance_type in instance_types:
-                InstanceRunResult.objects.update_or_create(
-                    defaults={
-                        'ping_response': ping_responses_json[instance_type],
-                        'web_response': browse_responses_json[instance_type],
-                    },
-                    instancerun=run,
-                    marvin=marvins[instance_type],
-                )
-
-        # We are starting!
+            messages.append((logging.WARNING,
+                             gettext_noop('This website has no IPv6 addresses so the IPv6-only test is skipped')))
+
+        # Results of earlier attempts are kept, only measure what is missing
+        measured = await database_sync(get_measured_instance_types, run)
+        if measured & instance_types:
+            print_notice(_("InstanceRun {run.pk} already has results for {types}").format(
+                run=run,
+                types=', '.join(sorted(measured & instance_types))
+            ))
+        instance_types -= measured
+
+        # The baseline is only used to check the dual-stack result
+        baseline = None
+        need_baseline = 'dual-stack' in instance_types
+        if need_baseline and settings.CONCURRENT_BASELINE:
+            # Use a recent result for the same URL if we have one, otherwise the baseline runs concurrently below
+            baseline = await database_sync(get_recent_baseline, run.url, workdir)
+        elif need_baseline:
+            # First determine a baseline
+            lease = (await get_marvins(['dual-stack'], retry_count))['dual-stack']
+            baseline = await browse_baseline(run, lease.marvin, lease, workdir)
+
+        results = {}
+        if instance_types:
+            slots = await get_marvins(instance_types, retry_count)
+            marvins = {instance_type: lease.marvin for instance_type, lease in slots.items()}
+
+            # Every measurement releases its slot when its requests are done, this releases the rest
+            held = list(slots.values())
+            try:
+                if baseline is not None or not need_baseline:
+                    results = await measure(run, marvins, slots, site_v4_addresses, site_v6_addresses, workdir)
+                else:
+                    # The baseline needs its own dual-stack slot to run next to the measurements
+                    baseline_slot = (await database_sync(find_marvins, ['dual-stack']))['dual-stack']
+                    if baseline_slot:
+                        held.append(baseline_slot)
+                        baseline, results = await asyncio.gather(
+                            browse_baseline(run, baseline_slot.marvin, baseline_slot, workdir),
+                            measure(run, marvins, slots, site_v4_addresses, site_v6_addresses, workdir),
+                            return_exceptions=True
+                        )
+                    else:
+                        results = await measure(run, marvins, slots, site_v4_addresses, site_v6_addresses, workdir)
+                        try:
+                            baseline_slot = (await get_marvins(['dual-stack'], retry_count))['dual-stack']
+                            baseline = await browse_baseline(run, baseline_slot.marvin, baseline_slot, workdir)
+                        except Exception as ex:
+                            baseline = ex
+            finally:
+                await database_sync(release_leases, held)
+
+        measurements = {instance_type: outcome for instance_type, outcome in results.items()
+                        if isinstance(outcome, Measurement)}
+        failed = {instance_type: outcome for instance_type, outcome in results.items()
+                  if isinstance(outcome, Exception)}
+        for instance_type, ex in failed.items():
+            if not isinstance(ex, RetryTaskException):
+                print_error("{instance_type}: {name}: {msg}".format(instance_type=instance_type,
+                                                                     name=type(ex).__name__,
+                                                                     msg=ex))
+
+        # A dual-stack result that couldn't be checked against a baseline isn't kept, the retry measures both again
+        if need_baseline and not isinstance(baseline, BrowseDocument) and 'dual-stack' in measurements:
+            del measurements['dual-stack']
+
+        # Compare dual-stack to the baseline
+        dual_stack = measurements.get('dual-stack')
+        if isinstance(baseline, BrowseDocument) and dual_stack:
+            if len(baseline.data['resources']) != len(dual_stack.document.data['resources']) or \
+                    not baseline.image_path or not dual_stack.document.image_path or \
+                    await run_analysis('compare', compare_image_files,
+                                       baseline.image_path, dual_stack.document.image_path) < 0.98:
+                messages.append((logging.WARNING,
+                                 gettext_noop('Two identical requests returned different results. '
+                                              'Results are going to be unpredictable.')))
+
+        if isinstance(baseline, Exception):
+            raise baseline
+
+        # Check if all tests succeeded
+        if failed:
+            timeout = randrange(5, 120)
+            print_error(_("Not all tests completed successfully ({types}), retrying in {timeout} seconds").format(
+                types=', '.join(sorted(failed)),
+                timeout=timeout
+            ))
+            raise RetryTaskException(timeout=timeout)
+
+        # We are done!
         run.finished = timezone.now()
-        run.save()
+        await database_sync(finish_instancerun, run, measurements, messages)
 
         print_message(_("Work on InstanceRun {run.pk} ({run.url}) completed").format(run=run))
 
     except RetryTaskException:
-        # Clear the started timestamp and messages so it can be retried, and trigger retry
-        InstanceRun.objects.filter(pk=pk).update(started=None, finished=None)
-        InstanceRunMessage.objects.filter(instancerun_id=pk).delete()
+        # Clear the started timestamp so it can be retried, and trigger retry
+        await database_sync(reset_instancerun, pk, measurements, messages)
         raise
 
     except InstanceRun.DoesNotExist:
@@ -305,7 +556,29 @@ def execute_instancerun(pk):
                                                              msg=ex))
         print_error(format_exc())
 
-        # Clear the started timestamp and messages so it can be retried, and trigger retry
-        InstanceRun.objects.filter(pk=pk).update(started=None, finished=None)
-        InstanceRunMessage.objects.filter(instancerun_id=pk).delete()
+        # Clear the started timestamp so it can be retried, and trigger retry
+        await database_sync(reset_instancerun, pk, measurements, messages)
         raise RetryTaskException
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@task(executor=TaskExecutor.SPOOLER, retry_count=5, retry_timeout=300)
+def execute_instancerun(pk):
+    current_task = get_current_task()
+    run_sync(prune_marvin_pools())
+    run_sync(run_instancerun(pk, current_task.setup['retry_count']))
+
+
+def dispatch_instancerun(run):
+    """
+    Schedule execution once the current transaction commits, so the task can see the run
+    """
+    pk, requested = run.pk, run.requested
+
+    def enqueue():
+        execute_instancerun.setup['at'] = requested
+        execute_instancerun(pk)
+
+    transaction.on_commit(enqueue)
@@ -3,46 +3,74 @@
 #  3-Clause License. Please see the LICENSE file in the project root directory.
 # ••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••••
 
+import gzip
+import json
+import random
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from traceback import print_exc
 from urllib.parse import urlsplit
 
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from requests.auth import AuthBase
-from uwsgi_tasks import RetryTaskException, task
+from uwsgi_tasks import RetryTaskException, TaskExecutor, task, timer
 
-from generic.utils import print_error, print_message, print_warning, retry_get
-from instances.models import Zaphod
-from measurements.api.serializers import InstanceRunSerializer
+from generic.utils import TokenAuth, print_error, print_message, print_notice, print_warning
+from instances.zaphods import get_zaphod, get_zaphod_session
+from measurements.documents import get_callback_document
 
+try:
+    # noinspection PyPackageRequirements
+    import uwsgi
+except ImportError:
+    uwsgi = None
 
-class TokenAuth(AuthBase):
-    def __init__(self, token):
-        self.token = token
 
-    def __call__(self, req):
-        req.headers['Authorization'] = 'Token {}'.format(self.token)
-        return req
+def get_document_headers(compressed):
+    headers = {'Content-Type': 'application/json'}
+    if compressed:
+        headers['Content-Encoding'] = 'gzip'
+    return headers
 
 
-@task(retry_count=5, retry_timeout=300)
+def get_queued_key(pk):
+    return 'instancerun_{}_update_queued'.format(pk)
+
+
+@task(executor=TaskExecutor.SPOOLER, retry_count=5, retry_timeout=300)
 def execute_update_zaphod(pk):
+    """
+    Update a run on a callback URL that doesn't belong to one of our Zaphods, those have their own delivery queues
+    """
     from measurements.models import InstanceRun
 
+    # Changes from now on need another update, the ones before are included in this one
+    cache.delete(get_queued_key(pk))
+
     try:
-        run = retry_get(InstanceRun.objects.all(), pk=pk)
+        run = InstanceRun.objects.get(pk=pk)
         if not run.callback_url:
             print_warning(_("No callback URL provided for InstanceRun {pk}").format(pk=pk))
             return
 
+        document = get_callback_document(run)
+        if document.hash == run.delivered_hash:
+            print_notice(_("InstanceRun {pk} hasn't changed since the last update, skipping").format(pk=pk))
+            return
+
         print_message(_("Updating InstanceRun {run.pk} ({run.url}) on {run.callback_url}").format(run=run))
 
         url = urlsplit(run.callback_url)
-        try:
-            zaphod = Zaphod.objects.get(hostname=url.netloc)
+        zaphod = get_zaphod(url.netloc)
+        if zaphod:
             auth = TokenAuth(zaphod.token)
-        except Zaphod.DoesNotExist:
+        else:
             print_warning(_("Unknown Zaphod at {url.netloc}, not authenticating").format(url=url))
             auth = None
 
@@ -51,22 +79,8 @@ def execute_update_zaphod(pk):
             url=run.callback_url,
             auth=auth,
             timeout=(5, 15),
-            json=InstanceRunSerializer(instance=run, context={
-                'expand': {
-                    'messages',
-                    'results__marvin'
-                },
-                'exclude': {
-                    'id',
-                    '_url',
-                    'results__id',
-                    'results__instancerun',
-                    'results__instancerun_id',
-                    'results___url',
-                    'results__marvin__id',
-                    'results__marvin___url'
-                }
-            }).data
+            headers=get_document_headers(document.compressed),
+            data=bytes(document.content)
         )
 
         if response.status_code != 200:
@@ -76,6 +90,9 @@ def execute_update_zaphod(pk):
             ))
             raise RetryTaskException
 
+        # Don't save the run, that would schedule another update
+        InstanceRun.objects.filter(pk=pk).update(delivered_hash=document.hash)
+
     except RetryTaskException:
         raise
 
@@ -92,3 +109,325 @@ def execute_update_zaphod(pk):
         print_exc()
 
         raise RetryTaskException
+
+
+def get_backoff(attempts):
+    """
+    Wait exponentially longer after every failed attempt. The jitter keeps updates that failed together from all
+    coming back at the same moment.
+    """
+    base, ceiling = settings.ZAPHOD_CALLBACK_BACKOFF
+    delay = min(ceiling, base * 2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def get_flush_key(zaphod_pk):
+    return 'zaphod_{}_flush'.format(zaphod_pk)
+
+
+def get_delivering_key(zaphod_pk):
+    return 'zaphod_{}_delivering'.format(zaphod_pk)
+
+
+def schedule_flush(zaphod_pk, delay=None):
+    """
+    Schedule delivery of the pending updates of a Zaphod, unless that already happens in time
+    """
+    if not uwsgi:
+        # Outside of uWSGI the flush would run right here, maybe inside another flush. The updates are left for
+        # flush_due_callbacks in the spooler instead.
+        print_notice(_("No spooler available, leaving the updates for Zaphod {pk} to the spooler").format(
+            pk=zaphod_pk
+        ))
+        return
+
+    if delay is None:
+        delay = settings.ZAPHOD_CALLBACK_WINDOW
+
+    at = timezone.now() + timedelta(seconds=delay)
+    scheduled = cache.get(get_flush_key(zaphod_pk))
+    if scheduled and scheduled <= at:
+        return
+
+    cache.set(get_flush_key(zaphod_pk), at, delay + settings.ZAPHOD_CALLBACK_WINDOW)
+    execute_flush_callbacks.setup['at'] = at
+    execute_flush_callbacks(zaphod_pk)
+
+
+def schedule_next_flush(zaphod_pk):
+    from measurements.models import PendingCallback
+
+    next_attempt = (PendingCallback.objects
+                    .filter(zaphod_id=zaphod_pk, dead=False)
+                    .aggregate(next_attempt=Min('next_attempt'))['next_attempt'])
+    if next_attempt:
+        schedule_flush(zaphod_pk, max(0.0, (next_attempt - timezone.now()).total_seconds()))
+
+
+def deliver_bulk(session, zaphod, runs, documents):
+    """
+    Deliver all documents in one request. Returns an error or None for each run that the Zaphod answered for, or
+    None if it doesn't accept bulk updates.
+    """
+    # The documents are already JSON, so they are put in the request as they are
+    updates = []
+    for pk, document in documents.items():
+        update = json.dumps({'id': pk, 'callback_url': runs[pk].callback_url}).encode('utf-8')
+        updates.append(update[:-1] + b', "data": ' + document.get_content() + b'}')
+
+    body = b'{"updates": [' + b', '.join(updates) + b']}'
+    if settings.CALLBACK_DOCUMENT_GZIP:
+        body = gzip.compress(body)
+
+    print_message(_("Delivering {count} updates to {zaphod.name} on {zaphod.bulk_callback_url}").format(
+        count=len(updates),
+        zaphod=zaphod
+    ))
+
+    try:
+        response = session.post(url=zaphod.bulk_callback_url, timeout=(5, 60),
+                                headers=get_document_headers(settings.CALLBACK_DOCUMENT_GZIP), data=body)
+    except requests.exceptions.RequestException as ex:
+        return {pk: str(ex) for pk in documents}
+
+    if response.status_code in (404, 405, 501):
+        # This Zaphod doesn't do bulk updates (anymore)
+        print_warning(_("{zaphod.bulk_callback_url} doesn't accept bulk updates, updating one by one").format(
+            zaphod=zaphod
+        ))
+        return None
+
+    if response.status_code != 200:
+        error = _('HTTP {status}').format(status=response.status_code)
+        return {pk: error for pk in documents}
+
+    # Each update is acknowledged separately
+    try:
+        return {result['id']: None if result['status'] == 200 else _('HTTP {status}').format(status=result['status'])
+                for result in response.json()['results']}
+    except (KeyError, TypeError, ValueError):
+        error = _('Invalid response')
+        return {pk: error for pk in documents}
+
+
+def deliver_each(session, zaphod, runs, documents):
+    """
+    Deliver the documents one by one, at most as many at the same time as the Zaphod allows. Returns an error or None
+    for each run.
+    """
+    unreachable = []
+
+    def deliver(pk):
+        if unreachable:
+            # Don't wait for timeouts over and over again
+            return unreachable[0]
+
+        try:
+            response = session.put(url=runs[pk].callback_url, timeout=(5, 15),
+                                   headers=get_document_headers(documents[pk].compressed),
+                                   data=bytes(documents[pk].content))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            unreachable.append(str(ex))
+            return str(ex)
+        except requests.exceptions.RequestException as ex:
+            return str(ex)
+
+        if response.status_code != 200:
+            return _('HTTP {status}').format(status=response.status_code)
+
+        return None
+
+    print_message(_("Delivering {count} updates to {zaphod.name}").format(count=len(documents), zaphod=zaphod))
+
+    with ThreadPoolExecutor(max_workers=zaphod.max_connections) as executor:
+        return dict(zip(documents, executor.map(deliver, documents)))
+
+
+def deliver_callbacks(zaphod, pending):
+    """
+    Deliver claimed callbacks. This happens outside of a transaction, so a callback that was replaced by a newer
+    revision of its run in the meantime is left alone when recording the outcome.
+    """
+    from measurements.models import InstanceRun, PendingCallback
+
+    runs = {run.pk: run for run in (InstanceRun.objects
+                                    .filter(pk__in=[callback.instancerun_id for callback in pending])
+                                    .select_related('callback_document'))}
+
+    # There is only one pending callback per run, and it delivers the latest state
+    documents = {}
+    for pk, run in runs.items():
+        document = get_callback_document(run)
+        if document.hash != run.delivered_hash:
+            documents[pk] = document
+
+    unchanged = [callback for callback in pending if callback.instancerun_id not in documents]
+    if unchanged:
+        print_notice(_("{count} runs haven't changed since their last update, skipping").format(count=len(unchanged)))
+        with transaction.atomic():
+            for callback in unchanged:
+                PendingCallback.objects.filter(pk=callback.pk, revision=callback.revision).delete()
+        pending = [callback for callback in pending if callback.instancerun_id in documents]
+        if not pending:
+            return
+
+    session = get_zaphod_session(zaphod)
+    results = deliver_bulk(session, zaphod, runs, documents) if zaphod.bulk_callback_url else None
+    if results is None:
+        results = deliver_each(session, zaphod, runs, documents)
+
+    delivered = {pk for pk, error in results.items() if error is None and pk in documents}
+    failed = [callback for callback in pending if callback.instancerun_id not in delivered]
+    if failed:
+        print_error(_("{zaphod.name} didn't accept {count} updates, trying again later").format(
+            zaphod=zaphod,
+            count=len(failed)
+        ))
+
+    now = timezone.now()
+    with transaction.atomic():
+        for callback in pending:
+            if callback.instancerun_id in delivered:
+                PendingCallback.objects.filter(pk=callback.pk, revision=callback.revision).delete()
+
+                # Don't save the run, that would schedule another update
+                InstanceRun.objects.filter(pk=callback.instancerun_id).update(
+                    delivered_hash=documents[callback.instancerun_id].hash
+                )
+                continue
+
+            callback.attempts += 1
+            callback.last_error = str(results.get(callback.instancerun_id) or _('Not acknowledged'))[:200]
+            if callback.attempts >= settings.ZAPHOD_CALLBACK_ATTEMPTS:
+                print_error(_("Giving up on delivering InstanceRun {callback.instancerun_id} to {zaphod.name}: "
+                              "{callback.last_error}").format(callback=callback, zaphod=zaphod))
+                callback.dead = True
+            else:
+                callback.next_attempt = now + get_backoff(callback.attempts)
+
+            PendingCallback.objects.filter(pk=callback.pk, revision=callback.revision).update(
+                attempts=callback.attempts,
+                last_error=callback.last_error,
+                next_attempt=callback.next_attempt,
+                dead=callback.dead,
+            )
+
+
+@task(executor=TaskExecutor.SPOOLER)
+def execute_flush_callbacks(zaphod_pk):
+    """
+    Deliver the updates of a Zaphod that are due. Failed updates are not retried by the spooler, they get a later
+    next attempt instead and the next flush is scheduled for when the first one is due. Only one flush at a time
+    delivers to a Zaphod, so it never gets more than its maximum number of connections.
+    """
+    from measurements.models import PendingCallback
+
+    # Updates that come in from now on need another flush
+    cache.delete(get_flush_key(zaphod_pk))
+
+    if not cache.add(get_delivering_key(zaphod_pk), True, settings.ZAPHOD_CALLBACK_LEASE_TIME):
+        # Another flush is busy, try again when it has probably finished
+        schedule_flush(zaphod_pk)
+        return
+
+    try:
+        # Claim the updates by moving their next attempt past the delivery, so no locks are held while talking to
+        # the Zaphod. If we crash they become due again when the claim expires.
+        with transaction.atomic():
+            pending = list(PendingCallback.objects
+                           .select_for_update(skip_locked=True, of=('self',))
+                           .select_related('zaphod')
+                           .filter(zaphod_id=zaphod_pk, dead=False, next_attempt__lte=timezone.now())
+                           [:settings.ZAPHOD_CALLBACK_BATCH_SIZE])
+
+            claimed_until = timezone.now() + timedelta(seconds=settings.ZAPHOD_CALLBACK_LEASE_TIME)
+            claimed = [callback.pk for callback in pending]
+            PendingCallback.objects.filter(pk__in=claimed).update(next_attempt=claimed_until)
+
+        if pending:
+            deliver_callbacks(pending[0].zaphod, pending)
+
+        # This also picks up claims that expired after a crash
+        schedule_next_flush(zaphod_pk)
+
+    except Exception as ex:
+        print_error(_('{name} on line {line}: {msg}').format(
+            name=type(ex).__name__,
+            line=sys.exc_info()[-1].tb_lineno,
+            msg=ex
+        ))
+        print_exc()
+
+        # Try again later without occupying the spooler in the meantime, claimed updates are due again when their
+        # claim expires
+        schedule_flush(zaphod_pk, settings.ZAPHOD_CALLBACK_BACKOFF[0])
+
+    finally:
+        cache.delete(get_delivering_key(zaphod_pk))
+
+
+@timer(seconds=settings.ZAPHOD_CALLBACK_SWEEP_INTERVAL, executor=TaskExecutor.SPOOLER)
+def flush_due_callbacks(signum):
+    """
+    Schedule a flush for every Zaphod that has updates that are due. This picks up replayed callbacks, claims that
+    expired after a crash and updates that were queued outside of uWSGI.
+    """
+    from measurements.models import PendingCallback
+
+    zaphods = set(PendingCallback.objects
+                  .filter(dead=False, next_attempt__lte=timezone.now())
+                  .values_list('zaphod_id', flat=True))
+    for zaphod_pk in zaphods:
+        schedule_flush(zaphod_pk, 0)
+
+
+def replay_callbacks(callbacks):
+    """
+    Give dead callbacks a new set of attempts, returns how many there were. They are delivered by the next
+    flush_due_callbacks.
+    """
+    return callbacks.filter(dead=True).update(dead=False, attempts=0, next_attempt=timezone.now(), last_error='')
+
+
+def enqueue_update_zaphod(pk, revision, callback_url):
+    from measurements.models import PendingCallback
+
+    zaphod = get_zaphod(urlsplit(callback_url).netloc)
+    if not zaphod:
+        if cache.add(get_queued_key(pk), True, settings.ZAPHOD_CALLBACK_COALESCE_TIME):
+            execute_update_zaphod(pk)
+        return
+
+    # A new state gets a new set of attempts
+    PendingCallback.objects.update_or_create(instancerun_id=pk, defaults={
+        'zaphod': zaphod,
+        'revision': revision,
+        'attempts': 0,
+        'next_attempt': timezone.now(),
+        'last_error': '',
+        'dead': False,
+    })
+    schedule_flush(zaphod.pk, None if zaphod.bulk_callback_url else 0)
+
+
+def dispatch_update_zaphod(run):
+    """
+    Schedule an update of the run once the current transaction commits, so the task can see it. Updates are
+    coalesced: when one is already waiting it will deliver the latest state, so no new one is needed. Updates for
+    our Zaphods go through their delivery queue, where the ones that accept them in bulk get them together.
+    """
+    pk, revision, callback_url = run.pk, run.revision, run.callback_url
+
+    def enqueue():
+        # The transaction has been committed, whatever goes wrong here must not reach the code that committed it
+        try:
+            enqueue_update_zaphod(pk, revision, callback_url)
+        except Exception as ex:
+            print_error(_("Unable to schedule an update of InstanceRun {pk}: {name}: {msg}").format(
+                pk=pk,
+                name=type(ex).__name__,
+                msg=ex
+            ))
+            print_exc()
+
+    transaction.on_commit(enqueue)
@@ -229,6 +229,99 @@ SECURE_BROWSER_XSS_FILTER = True
 # Refuse to be framed
 X_FRAME_OPTIONS = 'DENY'
 
+# Run InstanceRuns concurrently in the asyncio engine (a uWSGI mule) instead of one per spooler process
+ASYNC_ENGINE = bool(os.environ.get('TRILLIAN_ASYNC_ENGINE'))
+ASYNC_ENGINE_CONCURRENCY = int(os.environ.get('TRILLIAN_ASYNC_ENGINE_CONCURRENCY', '50'))
+ASYNC_ENGINE_POLL_INTERVAL = 5
+ASYNC_DATABASE_THREADS = 10
+
+# Run the baseline browse next to the measurements, or reuse a recent result for the same URL
+CONCURRENT_BASELINE = True
+BASELINE_REUSE_TIMEOUT = 300
+
+# Separate processes for CPU-bound analysis of results, how many at the same time and timeouts in seconds per stage
+ANALYSIS_WORKERS = int(os.environ.get('TRILLIAN_ANALYSIS_WORKERS', '2'))
+ANALYSIS_TIMEOUTS = {
+    'parse': 30,
+    'compare': 60,
+}
+
+# Idle keep-alive connections to Marvins are closed after this many seconds
+MARVIN_KEEPALIVE_TIMEOUT = 60
+
+# Every task on a Marvin browses and pings at the same time, so it gets this many connections: one for /browse and
+# one each for /ping4 and /ping6. Waiting for a free connection and connecting may take this many seconds.
+MARVIN_CONNECTIONS_PER_TASK = 3
+MARVIN_CONNECT_TIMEOUT = 30
+
+# Marvin discovery runs from a cron job that is killed after 50 seconds, so it stops waiting before that
+FINDMARVINS_DEADLINE = 40
+FINDMARVINS_WORKERS = 20
+FINDMARVINS_PROBE_TIMEOUT = (3, 10)
+
+# Marvins that push heartbeats do so this often, and are considered dead when they have been silent for too long.
+# Unchanged heartbeats only update last_seen in the database when it is older than the touch interval.
+MARVIN_HEARTBEAT_INTERVAL = 5
+MARVIN_HEARTBEAT_TIMEOUT = 15
+MARVIN_HEARTBEAT_TOUCH = 60
+
+# A reserved Marvin slot is freed after this many seconds, even if the task holding it has crashed
+MARVIN_LEASE_TIME = 300
+
+# Function that scores Marvins when picking one for a task, lower is better
+MARVIN_SCORER = 'instances.scoring.expected_latency_score'
+
+# Stop using a Marvin for this many seconds after this many consecutive failures, then let one request try it
+MARVIN_CIRCUIT_FAILURES = 3
+MARVIN_CIRCUIT_OPEN_TIME = 30
+
+# How long a Marvin may take to load a page
+MARVIN_BROWSE_TIMEOUT = 30
+
+# Requests to a Marvin time out after a multiple of a high percentile of its recent latencies for that endpoint,
+# but never sooner than the floor or later than the ceiling. The browse floor leaves the Marvin time to give up
+# on a slow page by itself.
+MARVIN_TIMEOUTS = {
+    'browse': (MARVIN_BROWSE_TIMEOUT + 5, 65),
+    'ping4': (5, 65),
+    'ping6': (5, 65),
+}
+MARVIN_TIMEOUT_PERCENTILE = 99
+MARVIN_TIMEOUT_FACTOR = 2
+
+# The number of tasks a Marvin gets is halved when /browse fails or times out
+MARVIN_LIMIT_DECREASE = 0.5
+
+# When a /browse is slower than this percentile of recent ones of its instance type, also send it to another
+# Marvin and use the first good response, for example 95. None disables this.
+BROWSE_HEDGE_PERCENTILE = None
+
+# How long a run in the asyncio engine waits for Marvin capacity before it is rescheduled, and how often it checks
+# in the meantime. Spooler tasks are rescheduled right away.
+MARVIN_WAIT_TIMEOUT = 120
+MARVIN_WAIT_INTERVAL = 5
+
+# Updates for Zaphods with a bulk callback URL are collected for this many seconds and then delivered together,
+# at most this many per request. Failed updates are tried again after an exponential backoff between the minimum
+# and maximum number of seconds, and are kept as dead callbacks to be replayed after this many attempts.
+ZAPHOD_CALLBACK_WINDOW = 5
+ZAPHOD_CALLBACK_BATCH_SIZE = 100
+ZAPHOD_CALLBACK_BACKOFF = (10, 3600)
+ZAPHOD_CALLBACK_ATTEMPTS = 10
+
+# Updates that are being delivered are claimed for this many seconds, after which they are due again in case the
+# delivery crashed. Other flushes for the same Zaphod wait for the delivery for at most as long. Updates that are
+# due without a flush being scheduled, like replayed ones, are picked up every this many seconds.
+ZAPHOD_CALLBACK_LEASE_TIME = 600
+ZAPHOD_CALLBACK_SWEEP_INTERVAL = 60
+
+# An update that is waiting in the spooler absorbs later changes to the same run for at most this many seconds
+ZAPHOD_CALLBACK_COALESCE_TIME = 300
+
+# Store the documents of finished runs gzip-compressed and send them to Zaphod that way. Only enable this when all
+# Zaphods accept gzip-encoded requests.
+CALLBACK_DOCUMENT_GZIP = False
+
 try:
     # Override default setting with local settings
     from .local_settings import *